@@ -7,6 +7,7 @@
     'depends': ['base'],
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'views/api_access_token.xml',
     ],
     'installable': True,
@@ -0,0 +1,68 @@
+import gzip
+import hashlib
+import json
+
+from werkzeug.http import unquote_etag
+
+from odoo.http import request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Payloads smaller than this are sent uncompressed: the gain would not pay for the CPU
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def data_version(model, domain):
+    """ (count, last write_date) of the records of ``domain``, from one aggregate
+    query: it changes whenever a record is created, written or deleted """
+    count, last_write = model._read_group(domain, aggregates=['__count', 'write_date:max'])[0]
+    return count, last_write.isoformat() if last_write else None
+
+
+def make_etag(*parts):
+    """ ETag of a data version, ``parts`` being the request parameters and
+    data_version() values the response is built from.
+
+    It is a weak validator: the same tag is sent with the identity, gzip and
+    brotli forms of the body, which a strong one would have to tell apart. """
+    return 'W/"%s"' % hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def _cache_headers(etag):
+    headers = [('Vary', 'Accept-Encoding')]
+    if etag:
+        # The app keeps the body and revalidates it on every call
+        headers += [('ETag', etag), ('Cache-Control', 'private, no-cache')]
+    return headers
+
+
+def not_modified(etag):
+    """ 304 response when the client sent ``etag`` in If-None-Match, None otherwise.
+
+    Called before the records are read, so an unchanged list costs the
+    data_version() queries only. """
+    # Weak comparison, as required for If-None-Match
+    if etag and request.httprequest.if_none_match.contains_weak(unquote_etag(etag)[0]):
+        return Response(status=304, headers=_cache_headers(etag))
+    return None
+
+
+def json_response(data, etag=None, status=200):
+    """ JSON response, brotli or gzip compressed when it is large enough and the
+    client accepts it """
+    body = json.dumps(data, default=str).encode()
+    headers = _cache_headers(etag)
+    if len(body) >= COMPRESS_MIN_SIZE:
+        accepted = request.httprequest.accept_encodings
+        if brotli and accepted['br']:
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+            headers.append(('Content-Encoding', 'br'))
+        elif accepted['gzip']:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            headers.append(('Content-Encoding', 'gzip'))
+    return Response(body, status=status, headers=headers, content_type='application/json')
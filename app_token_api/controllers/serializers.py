@@ -0,0 +1,81 @@
+import math
+
+# Header / line columns read by the visit list APIs (many2one values are read as plain ids)
+VISIT_FIELDS = [
+    'name', 'mr_id', 'doctor_id', 'doc_unique_id', 'territory_id', 'asm_state',
+    'create_date', 'record_save', 'unlock_for_edit', 'bulk_unlock_id',
+    'bulk_unlocked_by', 'bulk_unlock_date', 'rejection_reason',
+]
+LINE_FIELDS = [
+    'mr_doctor_id', 'month', 'category_id', 'product_id', 'rate_type',
+    'price_unit', 'product_qty', 'amount', 'discount_percent',
+]
+
+# Field used as label for each related model
+NAME_FIELDS = {
+    'res.users': 'name',
+    'res.partner': 'name',
+    'territory.name': 'name',
+    'product.category': 'name',
+    'product.template': 'display_name',
+}
+
+
+def safe_float(val):
+    try:
+        if val is None or (isinstance(val, float) and math.isnan(val)):
+            return 0.0
+        return round(float(val), 2)
+    except Exception:
+        return 0.0
+
+
+class VisitBatch:
+    """ Set-based loader for mr.doctor visits.
+
+    Headers, lines and the labels of every related record are fetched with a
+    fixed number of queries (one read per model) whatever the number of visits,
+    instead of walking ``visit.line_ids`` and the many2one fields record by record.
+    """
+
+    def __init__(self, visits, include_lines=True, line_fields=None):
+        self.env = visits.env
+        self.headers = visits.read(VISIT_FIELDS, load=None)
+        self.lines_by_visit = {header['id']: [] for header in self.headers}
+
+        if include_lines or line_fields:
+            lines = self.env['mr.doctor.line'].sudo().search_read(
+                [('mr_doctor_id', 'in', visits.ids)],
+                line_fields or LINE_FIELDS,
+                order='id',
+                load=None,
+            )
+            for line in lines:
+                self.lines_by_visit[line['mr_doctor_id']].append(line)
+        else:
+            lines = []
+
+        related_ids = {
+            'res.users': {h['mr_id'] for h in self.headers} | {h['bulk_unlocked_by'] for h in self.headers},
+            'res.partner': {h['doctor_id'] for h in self.headers},
+            'territory.name': {h['territory_id'] for h in self.headers},
+            'product.category': {l.get('category_id') for l in lines},
+            'product.template': {l.get('product_id') for l in lines},
+        }
+        self._names = {}
+        for model, ids in related_ids.items():
+            ids = [i for i in ids if i]
+            if not ids:
+                continue
+            field = NAME_FIELDS[model]
+            for rec in self.env[model].sudo().browse(ids).read([field]):
+                self._names[model, rec['id']] = rec[field]
+
+    def name(self, model, record_id):
+        """ Label of a related record, None when the many2one is empty """
+        if not record_id:
+            return None
+        return self._names.get((model, record_id))
+
+    def lines(self, header):
+        return self.lines_by_visit.get(header['id'], [])
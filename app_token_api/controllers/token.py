@@ -1,7 +1,6 @@
 from odoo.http import  Response, request
 import json
 import logging
-from datetime import datetime
 
 _logger = logging.getLogger(__name__)
 
@@ -14,23 +13,18 @@ def validate_partner_token(request, user_id):
             return None, "Missing or invalid token format"
 
         token = auth_header.split(' ')[1]
-        user = request.env['res.users'].sudo().search([
-            ('id', '=', user_id),
-            ('active', '=', True)
-        ], limit=1)
-        _logger.info("User found: %s", user)
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None, "Invalid user_id"
 
-        api_key_record = request.env['partner.api.key'].sudo().search([
-            ('user_id', '=',user.id),
-            ('api_key', '=', token),
-            ('expiry_date', '>=', datetime.now())
-        ], limit=1)
+        # Token -> user lookup is cached per worker and invalidated on key/user changes
+        owner_id = request.env['partner.api.key'].sudo()._get_token_user_id(token, user_id)
+        _logger.info("Token owner found: %s", owner_id)
 
-        _logger.info("API Key Record: %s", api_key_record)
-
-        if not api_key_record:
+        if not owner_id:
             return None, "Token is Expired"
-        return api_key_record.user_id, None
+        return request.env['res.users'].sudo().browse(owner_id), None
 
 def validate_api_request(request, kwargs):
         """ Common function for user_id + token validation """
@@ -44,12 +38,12 @@ def validate_api_request(request, kwargs):
             
         # :white_tick: Validate token
         user, error = validate_partner_token(request, user_id)
-        _logger.warning(f"[API] Token validation failed: {error}")
         if error:
+            _logger.warning("[API] Token validation failed: %s", error)
             return None, Response(json.dumps({
                 "success": False,
                 "message": error
             }), content_type='application/json')
-        _logger.info(f"Token validated for user: {user.id} - {user.name}")
+        _logger.info("Token validated for user: %s", user.id)
         return user, None
 
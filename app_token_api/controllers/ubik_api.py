@@ -1,20 +1,55 @@
 from odoo import http,fields
 from odoo.http import request, Response
+from odoo.exceptions import UserError
 from .token import validate_api_request
+from .serializers import VisitBatch, safe_float
+from .responses import data_version, make_etag, not_modified, json_response
+from .visit_payloads import (
+    PayloadError, MAX_BULK_VISITS, VISIT_SCHEMA, VISIT_EDIT_SCHEMA, parse_json, parse_visit,
+    read_json_body, parse_form_lines, load_products, load_months, check_visit_lines,
+)
 from datetime import datetime
+from psycopg2 import IntegrityError
 import json
-import math
 import logging
 
 _logger = logging.getLogger(__name__)
 
-def safe_float(val):
-    try:
-        if val is None or (isinstance(val, float) and math.isnan(val)):
-            return 0.0
-        return round(float(val), 2)
-    except Exception:
-        return 0.0
+def collect_changes(records, since, is_visible, serialize):
+    """ Split ``records`` changed since the ``since`` watermark into serialized
+    updates and removed ids, and compute the next watermark """
+    updated, removed = [], []
+    for rec in records:
+        if is_visible(rec):
+            updated.append(serialize(rec))
+        else:
+            removed.append(rec.id)
+    watermark = max(records.mapped('write_date')) if records else since
+    return {
+        "updated": updated,
+        "removed": removed,
+        "watermark": fields.Datetime.to_string(watermark) if watermark else None,
+    }
+
+# Upper bound for the page size a client can request on paginated lists
+MAX_PAGE_SIZE = 200
+
+def parse_bool(val, default=True):
+    """ Read a boolean form parameter ('1', 'true', 'yes' / '0', 'false', 'no') """
+    if val is None or val == '':
+        return default
+    return str(val).strip().lower() not in ('0', 'false', 'no', 'off')
+
+def get_employee_profile(user):
+    """ Cached profile (territories, divisions, job, manager) of the employee of
+    the API user, None without one; see hr.employee._get_employee_profile """
+    return request.env['hr.employee'].sudo()._get_employee_profile(user.id)
+
+def parse_field_list(val):
+    """ Turn 'a,b,c' into {'a', 'b', 'c'}; None means every field """
+    if not val:
+        return None
+    return {f.strip() for f in str(val).split(',') if f.strip()}
 
 ############### API to list product categories present in odoo databse in mobile app ##########################
 
@@ -85,17 +120,15 @@ class ProductAPI(http.Controller):
             )
         
         # Validate that the territory belongs to the MR
-        employee = request.env['hr.employee'].sudo().search([
-            ('user_id', '=', user.id)
-        ], limit=1)
+        profile = get_employee_profile(user)
 
-        if not employee:
+        if not profile:
             return Response(json.dumps({
                 "success": False,
                 "message": "Employee not found"
             }), content_type='application/json')
 
-        if int(territory_id) not in employee.territory_ids.ids:
+        if int(territory_id) not in profile.territory_ids:
             return Response(json.dumps({
                 "success": False,
                 "message": "Territory not assigned to this MR"
@@ -111,23 +144,21 @@ class ProductAPI(http.Controller):
                 content_type='application/json'
             )
 
-        all_products = request.env['product.template'].sudo().search([
+        # Division and territory visibility resolved by one search
+        Product = request.env['product.template'].sudo()
+        product_domain = [
             ('categ_id', 'child_of', int(category_id)),
             ('active', '=', True),
-           
-        ])
+        ] + Product._get_territory_visibility_domain([int(territory_id)])
 
-        # Filter products based on territory
-        filtered_products = request.env['product.template']
-        
-        for product in all_products:
-            
-            if product.is_territory_specific_product:
-                if int(territory_id) in product.allowed_territory_ids.ids:
-                    filtered_products |= product
-            else:
-                # If product is not territory specific, include it
-                filtered_products |= product
+        # Nothing to send when the app already has this version of the list
+        etag = make_etag('products_by_category', int(category_id), int(territory_id),
+                         data_version(Product, product_domain))
+        response = not_modified(etag)
+        if response:
+            return response
+
+        filtered_products = Product.search(product_domain)
 
         if not filtered_products:
             return Response(
@@ -147,15 +178,11 @@ class ProductAPI(http.Controller):
             'allowed_territories': [t.id for t in p.allowed_territory_ids] if p.is_territory_specific_product else []  
         } for p in filtered_products]
 
-        return Response(
-            json.dumps({
-                'success': True,
-                'count': len(data),
-                'products': data
-            }),
-            status=200,
-            content_type='application/json'
-        )
+        return json_response({
+            'success': True,
+            'count': len(data),
+            'products': data
+        }, etag=etag)
 
 ############### API to list product category as per the categories assigned to MR ##########################
 
@@ -169,17 +196,15 @@ class MRCategoryAPI(http.Controller):
         if error_response:
             return error_response
 
-        employee = request.env['hr.employee'].sudo().search([
-            ('user_id', '=', user.id)
-        ], limit=1)
+        profile = get_employee_profile(user)
 
-        if not employee:
+        if not profile:
             return Response(json.dumps({
                 "success": False,
                 "message": "Employee not found"
             }), content_type='application/json')
 
-        categories = employee.product_category_ids
+        categories = request.env['product.category'].sudo().browse(profile.category_ids)
         if not categories:
             return Response(
                 json.dumps({
@@ -211,17 +236,16 @@ class MRTerritoryAPI(http.Controller):
         if error_response:
             return error_response
 
-        employee = request.env['hr.employee'].sudo().search(
-            [('user_id', '=', user.id)], limit=1)
+        profile = get_employee_profile(user)
 
-        if not employee or not employee.territory_ids:
+        if not profile or not profile.territory_ids:
             return Response(json.dumps({
                 "success": False,
                 "message": "No territories assigned"
             }), content_type='application/json')
 
         data = [{'id': t.id, 'name': t.name}
-                for t in employee.territory_ids]
+                for t in request.env['territory.name'].sudo().browse(profile.territory_ids)]
 
         return Response(json.dumps({
             "success": True,
@@ -246,20 +270,26 @@ class MRDoctorAPI(http.Controller):
                 "message": "territory_id is required"
             }), content_type='application/json')
 
-        employee = request.env['hr.employee'].sudo().search(
-            [('user_id', '=', user.id)], limit=1)
+        profile = get_employee_profile(user)
 
-        if int(territory_id) not in employee.territory_ids.ids:
+        if not profile or int(territory_id) not in profile.territory_ids:
             return Response(json.dumps({
                 "success": False,
                 "message": "Territory not assigned to MR"
             }), content_type='application/json')
 
-        doctors = request.env['res.partner'].sudo().search([
+        Partner = request.env['res.partner'].sudo()
+        doctor_domain = [
             ('is_doctor', '=', True),
             ('territory_id', '=', int(territory_id)),
             ('active', '=', True)
-        ])
+        ]
+        etag = make_etag('doctor_list_by_territory', int(territory_id), data_version(Partner, doctor_domain))
+        response = not_modified(etag)
+        if response:
+            return response
+
+        doctors = Partner.search(doctor_domain)
 
         data = [{
             'id': d.id,
@@ -267,10 +297,141 @@ class MRDoctorAPI(http.Controller):
             'territory_id': d.territory_id.id
         } for d in doctors]
 
-        return Response(json.dumps({
+        return json_response({
             "success": True,
             "count": len(data),
             "doctors": data
+        }, etag=etag)
+
+############### API to sync master data (categories, products, doctors) in one call ##########################
+class MasterDataSyncAPI(http.Controller):
+
+    @http.route('/sync_master_data', type='http', auth='public', cors='*', methods=['POST'], csrf=False)
+    def sync_master_data(self, **kwargs):
+        """
+        Delta sync of the master data used by the app.
+
+        ``watermarks`` is a JSON object with one write_date per section, e.g.
+        {"categories": "2025-06-01 10:00:00", "products": "...", "doctors": "..."},
+        as returned by the previous sync. A section without watermark is sent in full.
+        Each section returns the records created or changed since its watermark
+        (``updated``), the ids the MR must drop because they were archived or are
+        no longer visible (``removed``) and the new ``watermark``.
+        Territories and assigned divisions are small and always sent in full; when
+        they change, the app should sync again without watermarks.
+
+        ``product_ids`` and ``doctor_ids`` are optional JSON lists of the ids the
+        app holds: removals are only reported for records the MR can have
+        received, i.e. products of the MR's divisions, doctors of the MR's
+        territories and these ids (a product moved to another division or a
+        doctor moved to another territory is only known to be held through them).
+        """
+        user, error_response = validate_api_request(request, kwargs)
+        if error_response:
+            return error_response
+
+        profile = get_employee_profile(user)
+
+        if not profile:
+            return Response(json.dumps({
+                "success": False,
+                "message": "Employee not found"
+            }), content_type='application/json')
+
+        try:
+            watermarks = json.loads(kwargs.get('watermarks') or '{}')
+            since = {
+                section: fields.Datetime.to_datetime(watermarks.get(section)) if watermarks.get(section) else None
+                for section in ('categories', 'products', 'doctors')
+            }
+        except (ValueError, TypeError, AttributeError):
+            return Response(json.dumps({
+                "success": False,
+                "message": "Invalid watermarks value"
+            }), content_type='application/json')
+
+        held_ids = {}
+        for section in ('product_ids', 'doctor_ids'):
+            try:
+                held_ids[section] = [int(record_id) for record_id in json.loads(kwargs.get(section) or '[]')]
+            except (ValueError, TypeError):
+                return Response(json.dumps({
+                    "success": False,
+                    "message": f"Invalid {section} value"
+                }), content_type='application/json')
+
+        territory_ids = set(profile.territory_ids)
+        env = request.env(context=dict(request.env.context, active_test=False))
+
+        # ===== CATEGORIES =====
+        categories = env['product.category'].sudo().search(
+            [('write_date', '>', since['categories'])] if since['categories'] else [])
+        categories_data = collect_changes(
+            categories, since['categories'],
+            lambda c: True,
+            lambda c: {'id': c.id, 'name': c.name},
+        )
+
+        # ===== PRODUCTS (divisions of the MR, visible in at least one of the MR's territories) =====
+        allowed_categories = env['product.category'].sudo().search(
+            [('id', 'child_of', list(profile.category_ids))])
+        product_domain = [('categ_id', 'in', allowed_categories.ids), ('active', '=', True)] + \
+            env['product.template']._get_territory_visibility_domain(territory_ids)
+        if since['products']:
+            # Changed products may have left the MR's divisions or territories: they are reported
+            # as removed, but only when the MR can hold them, not across the whole catalogue
+            product_domain = [
+                ('write_date', '>', since['products']),
+                '|', ('categ_id', 'in', allowed_categories.ids), ('id', 'in', held_ids['product_ids']),
+            ]
+        products = env['product.template'].sudo().search(product_domain)
+
+        def product_visible(p):
+            if not p.active or p.categ_id not in allowed_categories:
+                return False
+            return not p.is_territory_specific_product or bool(territory_ids & set(p.allowed_territory_ids.ids))
+
+        products_data = collect_changes(
+            products, since['products'], product_visible,
+            lambda p: {
+                'id': p.id,
+                'name': p.name,
+                'price': p.list_price,
+                'category_id': p.categ_id.id,
+                'is_territory_specific': p.is_territory_specific_product,
+                'allowed_territories': p.allowed_territory_ids.ids if p.is_territory_specific_product else [],
+            },
+        )
+
+        # ===== DOCTORS (doctors of the MR's territories) =====
+        doctor_domain = [('is_doctor', '=', True), ('territory_id', 'in', list(territory_ids)), ('active', '=', True)]
+        if since['doctors']:
+            # Same as the products: changed doctors the MR can hold, whatever their is_doctor flag,
+            # so that a doctor leaving the MR's territories or no longer a doctor is reported as removed
+            doctor_domain = [
+                ('write_date', '>', since['doctors']),
+                '|', ('territory_id', 'in', list(territory_ids)), ('id', 'in', held_ids['doctor_ids']),
+            ]
+        doctors = env['res.partner'].sudo().search(doctor_domain)
+
+        doctors_data = collect_changes(
+            doctors, since['doctors'],
+            lambda d: d.active and d.is_doctor and bool(territory_ids & set(d.territory_id.ids)),
+            lambda d: {
+                'id': d.id,
+                'name': d.name,
+                'doctor_unique_id': d.doc_unique_id,
+                'territory_ids': d.territory_id.ids,
+            },
+        )
+
+        return Response(json.dumps({
+            "success": True,
+            "territories": [{'id': t.id, 'name': t.name} for t in request.env['territory.name'].sudo().browse(profile.territory_ids)],
+            "mr_category_ids": list(profile.category_ids),
+            "categories": categories_data,
+            "products": products_data,
+            "doctors": doctors_data,
         }), content_type='application/json')
 
 ############### API to manage Rate type ########################## 
@@ -362,31 +523,52 @@ class MRRateAPI(http.Controller):
             }
         }), content_type='application/json')
 
+def read_visit_payload(kwargs, schema=VISIT_SCHEMA, require_lines=True):
+    """ Visit sent either as a JSON body ({..., "lines": [...]}) or as the legacy
+    line_*[index] form fields, checked against ``schema`` before any database work.
+    Returns (kwargs, visit, error response); the JSON keys are merged into kwargs. """
+    try:
+        body = read_json_body(request.httprequest)
+        if body is not None:
+            kwargs = dict(kwargs, **{key: value for key, value in body.items() if key != 'lines'})
+            data = body
+        else:
+            data = dict(kwargs, lines=parse_form_lines(kwargs))
+        visit = parse_visit(data, require_lines=require_lines, schema=schema)
+    except PayloadError as e:
+        return kwargs, None, Response(json.dumps({
+            "success": False,
+            "message": str(e)
+        }), content_type='application/json')
+    return kwargs, visit, None
+
 class MrDoctorCreateAPI(http.Controller):
 
     @http.route('/create_mr_doctor_visit_record', type='http', auth='public', cors='*', methods=['POST'], csrf=False)
 
     def create_mr_doctor(self, **kwargs):
+        """
+        Create a visit and submit it to the manager.
+
+        Accepts the line_*[index] form fields, or an application/json body:
+            {"user_id": 1, "territory_id": 2, "doctor_id": 3,
+             "lines": [{"category_id": 4, "product_id": 5, "rate_type": "ptr_rate",
+                        "qty": 2, "price": 0, "month": "2025-06"}]}
+        """
+        kwargs, visit, error_response = read_visit_payload(kwargs)
+        if error_response:
+            return error_response
 
         user, error_response = validate_api_request(request, kwargs)
         if error_response:
             return error_response
-        
-        user_id = kwargs.get('user_id')
-        mr_id = kwargs.get('mr_id') or user_id
-        territory_id = kwargs.get('territory_id')
-        doctor_id = kwargs.get('doctor_id')
 
-        if not territory_id or not doctor_id:
-            return Response(json.dumps({
-                "success": False,
-                "message": "territory_id and doctor_id are required"
-            }), content_type='application/json')
+        territory_id = visit['territory_id']
+        doctor_id = visit['doctor_id']
 
-        employee = request.env['hr.employee'].sudo().search(
-            [('user_id', '=', user.id)], limit=1)
+        profile = get_employee_profile(user)
         
-        if not employee:
+        if not profile:
             return Response(json.dumps({
                 "success": False,
                 "message": "Employee not linked to this user"
@@ -399,19 +581,19 @@ class MrDoctorCreateAPI(http.Controller):
             }), content_type='application/json')
 
         # Allow MR / ASM / RSM / ZSM only
-        if employee.job_id.name not in ['MR', 'ASM', 'RSM', 'ZSM', 'ISM']:
+        if profile.job_name not in ['MR', 'ASM', 'RSM', 'ZSM', 'ISM']:
             return Response(json.dumps({
                 "success": False,
                 "message": "Only MR, ASM, RSM, ZSM and ISM can create visit records"
             }), content_type='application/json')
 
-        if int(territory_id) not in employee.territory_ids.ids:
+        if territory_id not in profile.territory_ids:
             return Response(json.dumps({
                 "success": False,
                 "message": "Territory not assigned to MR"
             }), content_type='application/json')
 
-        doctor = request.env['res.partner'].sudo().browse(int(doctor_id))
+        doctor = request.env['res.partner'].sudo().browse(doctor_id)
         if not doctor.is_doctor:
             return Response(json.dumps({
                 "success": False,
@@ -431,115 +613,292 @@ class MrDoctorCreateAPI(http.Controller):
         
         is_first_today = 1 if existing_today_count == 0 else 0
 
-        mr_doctor = request.env['mr.doctor'].sudo().create({
-            'mr_id': user.id,
-            'territory_id': int(territory_id),
-            'doctor_id': doctor.id,
-            'doc_unique_id': doctor.doc_unique_id,
-        })
+        # Validate the whole visit before any write: a rejected submission
+        # creates nothing and consumes no sequence number
+        try:
+            order_lines = check_visit_lines(
+                load_products(request.env, [line['product_id'] for line in visit['lines']]),
+                load_months(request.env), territory_id, visit['lines'])
+        except PayloadError as e:
+            return Response(json.dumps({
+                "success": False,
+                "message": str(e)
+            }), content_type='application/json')
 
-        # Create Lines
-        order_lines = []
-        index = 0
-        created_lines = 0
+        # Check for duplicate entries BEFORE creating: all the lines in one query
+        Line = request.env['mr.doctor.line'].sudo()
+        keys = [(doctor.id, line['product_id'], line['month']) for line in order_lines]
+        duplicates = Line._get_existing_line_keys(user.id, keys)
+        duplicates |= {key for key in keys if keys.count(key) > 1}
+        if duplicates:
+            _doctor_id, product_id, month = next(key for key in keys if key in duplicates)
+            return Response(json.dumps({
+                "success": False,
+                "message": f"Duplicate entry: Product '{Line.env['product.template'].browse(product_id).display_name}' for Dr. {doctor.name} in month {month} already exists. Duplicate records are not allowed."
+            }), content_type='application/json')
 
-        while True:
-            category_id = kwargs.get(f'line_category_id[{index}]')
-            product_id = kwargs.get(f'line_product_id[{index}]')
+        # The visit is submitted right away
+        if not profile.manager_user_id:
+            return Response(json.dumps({
+                "success": False,
+                "message": "No Manager defined for this user."
+            }), content_type='application/json')
 
-            if not category_id or not product_id:
-                break
+        # Header, lines and submission succeed or fail together
+        try:
+            with request.env.cr.savepoint():
+                mr_doctor = request.env['mr.doctor'].sudo().create({
+                    'mr_id': user.id,
+                    'territory_id': territory_id,
+                    'doctor_id': doctor.id,
+                    'doc_unique_id': doctor.doc_unique_id,
+                })
+                Line.create([dict(line_vals, mr_doctor_id=mr_doctor.id) for line_vals in order_lines])
+
+                # Automatically submit to manager
+                mr_doctor = mr_doctor.with_user(user)
+                mr_doctor.action_submit_to_asm()
+        except IntegrityError as e:
+            # A concurrent submission recorded the same lines first
+            if not Line._is_duplicate_line_error(e):
+                raise
+            return Response(json.dumps({
+                "success": False,
+                "message": f"Duplicate entry for Dr. {doctor.name}: these products are already recorded for this month. Duplicate records are not allowed."
+            }), content_type='application/json')
+        except UserError as e:
+            return Response(json.dumps({
+                "success": False,
+                "message": str(e)
+            }), content_type='application/json')
 
-            month = kwargs.get(f'line_month[{index}]') or datetime.today().strftime('%Y-%m')
+        return Response(json.dumps({
+            "success": True,
+            "message": "MR Doctor visit created and submitted to manager",
+            "mr_doctor_id": mr_doctor.id,
+           "created_on": mr_doctor.create_date.strftime('%d-%m-%Y') if mr_doctor.create_date else None,
+            "reference": mr_doctor.name,
+            "status": mr_doctor.asm_state,
+            "is_first_today": is_first_today,  # Add this to response
+            "declaration_required": is_first_today  # Add this for app to know if declaration needed
+        }), content_type='application/json')
 
-            rate_type = kwargs.get(f'line_rate_type[{index}]')
-            qty = float(kwargs.get(f'line_qty[{index}]', 1))
-            price = float(kwargs.get(f'line_price[{index}]', 0))
+############### API to create several MR Doctor visits in one call (offline capture replay) ##########################
+class MrDoctorBulkCreateAPI(http.Controller):
 
-            product = request.env['product.template'].sudo().browse(int(product_id))
-            if not product.exists():
-                return Response(json.dumps({
-                    "success": False,
-                    "message": f"Invalid product_id: {product_id}"
-                }), content_type='application/json')
-            
-            if product.is_territory_specific_product:
-                if int(territory_id) not in product.allowed_territory_ids.ids:
-                    return Response(json.dumps({
-                        "success": False,
-                        "message": f"Product '{product.display_name}' is not allowed in the selected territory"
-                    }), content_type='application/json')
-            
-            if rate_type not in ['ptr_rate', 'custom_rate']:
-                return Response(json.dumps({
-                    "success": False,
-                    "message": f"Invalid rate type at line {index}"
-                }), content_type='application/json')
+    @http.route('/create_mr_doctor_visit_records_bulk', type='http', auth='public', cors='*', methods=['POST'], csrf=False)
+    def create_mr_doctor_bulk(self, **kwargs):
+        """
+        Create the visits captured offline by the app in one call.
+
+        ``visits`` is a JSON array (at most MAX_BULK_VISITS) of objects:
+            {"client_ref": "...", "territory_id": 1, "doctor_id": 2,
+             "lines": [{"category_id": 3, "product_id": 4, "rate_type": "ptr_rate",
+                        "qty": 2, "price": 0, "month": "2025-06"}]}
+        ``client_ref`` is generated by the app and unique per MR: a visit already
+        created by an earlier attempt is returned again (status "existing") instead
+        of being created twice, so the call can be retried safely.
+        Each visit gets its own result; a rejected visit does not block the others.
+        """
+        user, error_response = validate_api_request(request, kwargs)
+        if error_response:
+            return error_response
 
-            # PTR logic
-            if rate_type == 'ptr_rate':
-                price = product.list_price
-            
-            if rate_type == 'custom_rate' and price > product.list_price:
-                return Response(json.dumps({
-                    "success": False,
-                    "message": f"Custom price cannot exceed PTR rate for product {product.display_name}"
-                }), content_type='application/json')
+        profile = get_employee_profile(user)
 
-            # Check for duplicate entry BEFORE creating
-            existing_entry = request.env['mr.doctor.line'].sudo().search([
-                ('mr_doctor_id.doctor_id', '=', int(doctor_id)),
-                ('product_id', '=', int(product_id)),
-                ('month', '=', month),
-                ('mr_doctor_id.mr_id', '=', user.id),  # Ensure it's the same MR
-                ('mr_doctor_id', '!=', mr_doctor.id)
-            ], limit=1)
-
-            if existing_entry:
-                # Duplicate found - rollback the header if this is the first line
-                if index == 0:  # If this is the first line and duplicate, delete the header
-                    mr_doctor.sudo().unlink()
-                
-                return Response(json.dumps({
-                    "success": False,
-                    "message": f"Duplicate entry: Product '{product.display_name}' for Dr. {doctor.name} in month {month} already exists. Duplicate records are not allowed."
-                }), content_type='application/json')
+        if not profile:
+            return Response(json.dumps({
+                "success": False,
+                "message": "Employee not linked to this user"
+            }), content_type='application/json')
 
-            order_lines.append({
-                'mr_doctor_id': mr_doctor.id,
-                'category_id': int(category_id),
-                'product_id': product.id,
-                'rate_type': rate_type,
-                'price_unit': price,
-                'product_qty': qty,
-                'month': month,
-              
-            })
+        if not user.has_group('ubik_app.group_sales_user'):
+            return Response(json.dumps({
+                "success": False,
+                "message": "You are not allowed to create visit records"
+            }), content_type='application/json')
 
-            created_lines += 1
-            index += 1
+        # Allow MR / ASM / RSM / ZSM only
+        if profile.job_name not in ['MR', 'ASM', 'RSM', 'ZSM', 'ISM']:
+            return Response(json.dumps({
+                "success": False,
+                "message": "Only MR, ASM, RSM, ZSM and ISM can create visit records"
+            }), content_type='application/json')
 
-        if not order_lines:
+        # Created visits are submitted to the manager right away
+        if not profile.manager_user_id:
             return Response(json.dumps({
                 "success": False,
-                "message": "At least one product is required"
+                "message": "No Manager defined for this user."
             }), content_type='application/json')
 
-        request.env['mr.doctor.line'].sudo().create(order_lines)
+        try:
+            raw_visits = parse_json(kwargs.get('visits'), 'visits')
+            if not isinstance(raw_visits, list) or not raw_visits:
+                raise PayloadError("visits must be a non-empty JSON array")
+            if len(raw_visits) > MAX_BULK_VISITS:
+                raise PayloadError(f"At most {MAX_BULK_VISITS} visits can be sent at once")
+        except PayloadError as e:
+            return Response(json.dumps({
+                "success": False,
+                "message": str(e)
+            }), content_type='application/json')
+
+        results = [None] * len(raw_visits)
+
+        def reject(index, client_ref, message):
+            results[index] = {
+                "index": index,
+                "client_ref": client_ref,
+                "success": False,
+                "status": "error",
+                "message": message,
+            }
 
-        # Automatically submit to manager
-        mr_doctor = mr_doctor.with_user(user)
-        mr_doctor.action_submit_to_asm()
+        # ===== Payload checks (no database access) =====
+        visits = {}
+        for index, raw in enumerate(raw_visits):
+            client_ref = raw.get('client_ref') if isinstance(raw, dict) else None
+            try:
+                visit = parse_visit(raw, require_client_ref=True)
+                if any(v['client_ref'] == visit['client_ref'] for v in visits.values()):
+                    raise PayloadError("client_ref is repeated in this submission")
+                visits[index] = visit
+            except PayloadError as e:
+                reject(index, client_ref, str(e))
+
+        # ===== Set-based checks: one query per model for the whole submission =====
+        MrDoctor = request.env['mr.doctor'].sudo()
+        existing = {
+            visit['client_ref']: visit
+            for visit in MrDoctor.search_read([
+                ('mr_id', '=', user.id),
+                ('client_ref', 'in', [v['client_ref'] for v in visits.values()]),
+            ], ['client_ref', 'name', 'asm_state', 'create_date'])
+        }
+        doctors = {
+            doctor['id']: doctor
+            for doctor in request.env['res.partner'].sudo().browse(
+                list({v['doctor_id'] for v in visits.values()})
+            ).exists().read(['name', 'is_doctor', 'doc_unique_id'])
+        }
+        products = load_products(request.env, [
+            line['product_id'] for v in visits.values() for line in v['lines']
+        ])
+        months = load_months(request.env)
+        territory_ids = set(profile.territory_ids)
+
+        to_create = {}
+        for index, visit in visits.items():
+            previous = existing.get(visit['client_ref'])
+            if previous:
+                # Already created by an earlier attempt of this submission
+                results[index] = {
+                    "index": index,
+                    "client_ref": visit['client_ref'],
+                    "success": True,
+                    "status": "existing",
+                    "mr_doctor_id": previous['id'],
+                    "reference": previous['name'],
+                    "asm_state": previous['asm_state'],
+                    "created_on": previous['create_date'].strftime('%d-%m-%Y') if previous['create_date'] else None,
+                }
+                continue
+            try:
+                if visit['territory_id'] not in territory_ids:
+                    raise PayloadError("Territory not assigned to MR")
+                doctor = doctors.get(visit['doctor_id'])
+                if not doctor or not doctor['is_doctor']:
+                    raise PayloadError("Invalid doctor")
+                to_create[index] = (visit, doctor, check_visit_lines(products, months, visit['territory_id'], visit['lines']))
+            except PayloadError as e:
+                reject(index, visit['client_ref'], str(e))
+
+        # Duplicate (doctor, product, month) lines, against the recorded lines and
+        # within the submission
+        recorded = request.env['mr.doctor.line']._get_existing_line_keys(user.id, [
+            (visit['doctor_id'], vals['product_id'], vals['month'])
+            for visit, doctor, line_vals in to_create.values()
+            for vals in line_vals
+        ])
+        claimed = set()
+        for index in list(to_create):
+            visit, doctor, line_vals = to_create[index]
+            visit_keys = set()
+            for vals in line_vals:
+                key = (visit['doctor_id'], vals['product_id'], vals['month'])
+                if key in recorded or key in claimed or key in visit_keys:
+                    product_name = products[vals['product_id']]['display_name']
+                    reject(index, visit['client_ref'],
+                           f"Duplicate entry: Product '{product_name}' for Dr. {doctor['name']} in month {vals['month']} already exists. Duplicate records are not allowed.")
+                    del to_create[index]
+                    break
+                visit_keys.add(key)
+            else:
+                claimed |= visit_keys
+
+        # ===== Bulk creation =====
+        Line = request.env['mr.doctor.line'].sudo()
+
+        def create_visits(indexes):
+            """ Create and submit the visits of ``indexes``, all or none of them """
+            with request.env.cr.savepoint():
+                headers = MrDoctor.create([{
+                    'mr_id': user.id,
+                    'territory_id': to_create[index][0]['territory_id'],
+                    'doctor_id': to_create[index][1]['id'],
+                    'doc_unique_id': to_create[index][1]['doc_unique_id'],
+                    'client_ref': to_create[index][0]['client_ref'],
+                } for index in indexes])
+                Line.create([
+                    dict(vals, mr_doctor_id=header.id)
+                    for header, index in zip(headers, indexes)
+                    for vals in to_create[index][2]
+                ])
+                # Automatically submit to manager
+                headers.with_user(user).action_submit_to_asm()
+            return headers
+
+        created = {}
+        if to_create:
+            try:
+                created = dict(zip(to_create, create_visits(list(to_create))))
+            except (IntegrityError, UserError, ValueError):
+                # A visit failed the database or workflow checks (concurrent submission,
+                # no manager on the visit...): save the visits one by one, so only that
+                # one is rejected
+                _logger.info("Bulk visit submission of user %s saved visit by visit", user.id)
+                for index in to_create:
+                    visit, doctor, _line_vals = to_create[index]
+                    try:
+                        created[index] = create_visits([index])
+                    except IntegrityError as e:
+                        if Line._is_duplicate_line_error(e):
+                            # A concurrent submission recorded the same lines first
+                            reject(index, visit['client_ref'],
+                                   f"Duplicate entry for Dr. {doctor['name']}: these products are already recorded for this month. Duplicate records are not allowed.")
+                        else:
+                            # A concurrent retry of the same submission created this visit first
+                            reject(index, visit['client_ref'], "This visit is already being saved, please retry")
+                    except (UserError, ValueError) as e:
+                        reject(index, visit['client_ref'], str(e))
+
+            for index, header in created.items():
+                results[index] = {
+                    "index": index,
+                    "client_ref": header.client_ref,
+                    "success": True,
+                    "status": "created",
+                    "mr_doctor_id": header.id,
+                    "reference": header.name,
+                    "asm_state": header.asm_state,
+                    "created_on": header.create_date.strftime('%d-%m-%Y') if header.create_date else None,
+                }
 
         return Response(json.dumps({
             "success": True,
-            "message": "MR Doctor visit created and submitted to manager",
-            "mr_doctor_id": mr_doctor.id,
-           "created_on": mr_doctor.create_date.strftime('%d-%m-%Y') if mr_doctor.create_date else None,
-            "reference": mr_doctor.name,
-            "status": mr_doctor.asm_state,
-            "is_first_today": is_first_today,  # Add this to response
-            "declaration_required": is_first_today  # Add this for app to know if declaration needed
+            "created": len(created),
+            "results": results,
         }), content_type='application/json')
 
 
@@ -550,6 +909,13 @@ class MRDoctorListAPI(http.Controller):
         """
         List MR doctor visits along with edit/delete permissions
         (integrates logic from /check_mr_doctor_edit_permission API)
+
+        Optional parameters:
+            - limit: page size (max MAX_PAGE_SIZE); the response then carries next_cursor
+            - cursor: next_cursor of the previous page
+            - since: only visits created or changed after this datetime
+            - include_lines: '0' to skip the line details
+            - fields: comma separated list of visit keys to return
         """
 
         try:
@@ -558,36 +924,75 @@ class MRDoctorListAPI(http.Controller):
             if error_response:
                 return error_response
 
-            mr_visits = request.env['mr.doctor'].sudo().search([
-                ('mr_id', '=', user.id)
-            ], order='create_date desc')
+            # Optional pagination / projection parameters. Without them the full list is returned.
+            limit = kwargs.get('limit')
+            cursor = kwargs.get('cursor')
+            since = kwargs.get('since')
+            include_lines = parse_bool(kwargs.get('include_lines'))
+            requested_fields = parse_field_list(kwargs.get('fields'))
+
+            try:
+                limit = min(int(limit), MAX_PAGE_SIZE) if limit else None
+                # Opaque next_cursor of the previous page, checked here to answer a clear error
+                if cursor:
+                    request.env['mr.doctor']._parse_visit_cursor(cursor)
+                since = fields.Datetime.to_datetime(since) if since else None
+            except ValueError:
+                return Response(json.dumps({
+                    "success": False,
+                    "message": "Invalid limit, cursor or since value"
+                }), content_type='application/json')
 
-            if not mr_visits:
+            if limit is not None and limit <= 0:
                 return Response(json.dumps({
                     "success": False,
-                    "message": "No MR doctor visits found"
+                    "message": "limit must be greater than zero"
                 }), content_type='application/json')
 
+            # The edit / delete permissions depend on the current month too
             current_month = datetime.today().strftime('%Y-%m')
+            etag = make_etag(
+                'list_mr_doctor_visits', user.id, limit, cursor, since, include_lines,
+                sorted(requested_fields or []), current_month,
+                data_version(request.env['mr.doctor'].sudo(), [('mr_id', '=', user.id)]),
+                data_version(request.env['mr.doctor.line'].sudo(), [('mr_id', '=', user.id)]),
+            )
+            response = not_modified(etag)
+            if response:
+                return response
+
+            mr_visits, next_cursor = request.env['mr.doctor'].sudo()._get_visit_page(
+                user.id, limit=limit, cursor=cursor, since=since)
+
+            if not mr_visits and not (cursor or since):
+                return Response(json.dumps({
+                    "success": False,
+                    "message": "No MR doctor visits found"
+                }), content_type='application/json')
 
             visits_data = []
 
-            for visit in mr_visits:
+            # Headers, lines and related names in a fixed number of queries
+            batch = VisitBatch(mr_visits, include_lines=include_lines,
+                               line_fields=None if include_lines else ['mr_doctor_id', 'month'])
+
+            for visit in batch.headers:
 
                 line_items = []
+                visit_lines = batch.lines(visit)
 
                 # ===== IMPROVED PERMISSION LOGIC =====
                 # Check if any line is from current month
                 is_current_month = any(
-                    line.month == current_month for line in visit.line_ids
+                    line['month'] == current_month for line in visit_lines
                 )
 
                 # Check if record is locked (past month and not unlocked by admin)
                 # record_save is True for past month records that are NOT unlocked
-                is_locked = visit.record_save  # This already considers unlock_for_edit internally
+                is_locked = visit['record_save']  # This already considers unlock_for_edit internally
 
                 # Check if admin has specifically unlocked this record
-                is_admin_unlocked = visit.unlock_for_edit
+                is_admin_unlocked = visit['unlock_for_edit']
 
                 # Determine edit permission:
                 # 1. Current month records are always editable
@@ -604,67 +1009,77 @@ class MRDoctorListAPI(http.Controller):
                         reason = "Past month records are locked. Please contact Admin to unlock."
                     elif not is_current_month and not is_admin_unlocked:
                         reason = "This is a past month record that hasn't been unlocked by admin."
-                    elif visit.asm_state == 'verified':
+                    elif visit['asm_state'] == 'verified':
                         reason = "Verified records cannot be edited."
-                    elif visit.asm_state == 'submitted':
+                    elif visit['asm_state'] == 'submitted':
                         reason = "Record is under manager review."
                     else:
                         reason = "This record cannot be edited."
 
                 # ===== LINE DATA =====
-                for line in visit.line_ids:
+                for line in (visit_lines if include_lines else []):
                     line_items.append({
-                        "line_id": line.id,
-                        "month": line.month,
-                        "category_id": line.category_id.id if line.category_id else None,
-                        "category_name": line.category_id.name if line.category_id else None,
-                        "product_id": line.product_id.id if line.product_id else None,
-                        "product_name": line.product_id.display_name if line.product_id else None,
-                        "rate_type": line.rate_type,
-                        "unit_price": line.price_unit,
-                         "quantity": safe_float(line.product_qty),
-                        "amount": safe_float(line.amount),
-                        "discount_percent": round(line.discount_percent or 0.0, 2)
+                        "line_id": line['id'],
+                        "month": line['month'],
+                        "category_id": line['category_id'] or None,
+                        "category_name": batch.name('product.category', line['category_id']),
+                        "product_id": line['product_id'] or None,
+                        "product_name": batch.name('product.template', line['product_id']),
+                        "rate_type": line['rate_type'],
+                        "unit_price": line['price_unit'],
+                        "quantity": safe_float(line['product_qty']),
+                        "amount": safe_float(line['amount']),
+                        "discount_percent": round(line['discount_percent'] or 0.0, 2)
                     })
 
                 visit_data = {
-                    "mr_doctor_id": visit.id,
-                    "reference": visit.name,
-                    "mr_id": visit.mr_id.id if visit.mr_id else None,
-                    "mr_name": visit.mr_id.name if visit.mr_id else None,
-                    "doctor_id": visit.doctor_id.id if visit.doctor_id else None,
-                    "doctor_name": visit.doctor_id.name if visit.doctor_id else None,
-                    "doctor_unique_id": visit.doc_unique_id,
-                    "territory_id": visit.territory_id.id if visit.territory_id else None,
-                    "territory_name": visit.territory_id.name if visit.territory_id else None,
-                    "status": visit.asm_state,
-                    "total_lines": len(line_items),
-                    "lines": line_items,
-                    "created_on": visit.create_date.strftime('%d-%m-%Y') if visit.create_date else None,
+                    "mr_doctor_id": visit['id'],
+                    "reference": visit['name'],
+                    "mr_id": visit['mr_id'] or None,
+                    "mr_name": batch.name('res.users', visit['mr_id']),
+                    "doctor_id": visit['doctor_id'] or None,
+                    "doctor_name": batch.name('res.partner', visit['doctor_id']),
+                    "doctor_unique_id": visit['doc_unique_id'],
+                    "territory_id": visit['territory_id'] or None,
+                    "territory_name": batch.name('territory.name', visit['territory_id']),
+                    "status": visit['asm_state'],
+                    "total_lines": len(visit_lines),
+                    "created_on": visit['create_date'].strftime('%d-%m-%Y') if visit['create_date'] else None,
                     # ===== PERMISSION FLAGS =====
                     "can_edit": can_edit,
                     "can_delete": can_delete,
                     "is_locked": is_locked,
                     "is_current_month": is_current_month,
                     "is_admin_unlocked": is_admin_unlocked,
-                    "record_save": visit.record_save,  # This shows the computed lock status
-                    "unlock_for_edit": visit.unlock_for_edit,
-                    "bulk_unlock_id": visit.bulk_unlock_id,  # Include bulk operation info
-                    "bulk_unlocked_by": visit.bulk_unlocked_by.name if visit.bulk_unlocked_by else None,
-                    "bulk_unlock_date": visit.bulk_unlock_date.strftime('%Y-%m-%d %H:%M:%S') if visit.bulk_unlock_date else None,
+                    "record_save": visit['record_save'],  # This shows the computed lock status
+                    "unlock_for_edit": visit['unlock_for_edit'],
+                    "bulk_unlock_id": visit['bulk_unlock_id'],  # Include bulk operation info
+                    "bulk_unlocked_by": batch.name('res.users', visit['bulk_unlocked_by']),
+                    "bulk_unlock_date": visit['bulk_unlock_date'].strftime('%Y-%m-%d %H:%M:%S') if visit['bulk_unlock_date'] else None,
                     "reason": reason
                 }
 
-                if visit.asm_state == 'rejected':
-                    visit_data["rejection_reason"] = visit.rejection_reason or ""
+                if include_lines:
+                    visit_data["lines"] = line_items
+
+                if visit['asm_state'] == 'rejected':
+                    visit_data["rejection_reason"] = visit['rejection_reason'] or ""
+
+                if requested_fields:
+                    visit_data = {
+                        key: value for key, value in visit_data.items()
+                        if key in requested_fields or key == 'mr_doctor_id'
+                    }
 
                 visits_data.append(visit_data)
 
-            return Response(json.dumps({
+            return json_response({
                 "success": True,
                 "total_visits": len(visits_data),
-                "visits": visits_data
-            }, default=str), content_type='application/json')
+                "visits": visits_data,
+                "next_cursor": next_cursor,
+                "has_more": bool(next_cursor),
+            }, etag=etag)
 
         except Exception as e:
             _logger.exception("Error in /list_mr_doctor_visits API")
@@ -784,19 +1199,18 @@ class ManagerMRListAPI(http.Controller):
             }), content_type='application/json')
 
         # Get employee record of manager
-        manager_employee = request.env['hr.employee'].sudo().search(
-            [('user_id', '=', user.id)], limit=1)
+        manager_profile = get_employee_profile(user)
 
-        if not manager_employee:
+        if not manager_profile:
             return Response(json.dumps({
                 "success": False,
                 "message": "Manager employee record not found"
             }), content_type='application/json')
 
-        # Fetch MRs reporting to this manager
-        mr_employees = request.env['hr.employee'].sudo().search([
-            ('parent_id', '=', manager_employee.id),
-            ('user_id', '!=', False)
+        # Fetch MRs reporting to this manager, directly or through ASMs / RSMs
+        Employee = request.env['hr.employee'].sudo()
+        mr_employees = Employee.browse([
+            employee_id for employee_id, _user_id in Employee._get_team_members(user.id)
         ])
 
         if not mr_employees:
@@ -815,6 +1229,7 @@ class ManagerMRListAPI(http.Controller):
                 "user_id": emp.user_id.id if emp.user_id else None,
                 "user_name": emp.user_id.name if emp.user_id else None,
                 "job_position": emp.job_id.name if emp.job_id else None,
+                "manager_name": emp.parent_id.name if emp.parent_id else None,
                 "work_email": emp.work_email,
                 "mobile": emp.mobile_phone,
             })
@@ -861,67 +1276,74 @@ class ManagerMRDoctorVisitsAPI(http.Controller):
             }), content_type='application/json')
 
         # Get employees
-        manager_employee = request.env['hr.employee'].sudo().search(
-            [('user_id', '=', user.id)], limit=1)
+        manager_profile = get_employee_profile(user)
 
-        mr_employee = request.env['hr.employee'].sudo().search(
-            [('user_id', '=', selected_user.id)], limit=1)
+        mr_profile = get_employee_profile(selected_user)
 
-        if not manager_employee or not mr_employee:
+        if not manager_profile or not mr_profile:
             return Response(json.dumps({
                 "success": False,
                 "message": "Employee record not found"
             }), content_type='application/json')
 
-        # Check reporting
-        if mr_employee.parent_id.id != manager_employee.id:
+        # Check reporting, at any depth below the manager
+        if selected_user.id not in request.env['hr.employee'].sudo()._get_team_user_ids(user.id):
             return Response(json.dumps({
                 "success": False,
                 "message": "This MR does not report to you"
             }), content_type='application/json')
 
+        visit_domain = [('mr_id', '=', selected_user.id)]
+        etag = make_etag(
+            'manager_selected_mr_visits_list', selected_user.id,
+            data_version(request.env['mr.doctor'].sudo(), visit_domain),
+            data_version(request.env['mr.doctor.line'].sudo(), visit_domain),
+        )
+        response = not_modified(etag)
+        if response:
+            return response
+
         # Fetch visits
-        mr_visits = request.env['mr.doctor'].sudo().search([
-            ('mr_id', '=', selected_user.id)
-        ], order='create_date desc')
+        mr_visits = request.env['mr.doctor'].sudo().search(visit_domain, order='create_date desc')
 
         visits_data = []
+        batch = VisitBatch(mr_visits)
 
-        for visit in mr_visits:
+        for visit in batch.headers:
             line_items = []
-            for line in visit.line_ids:
+            for line in batch.lines(visit):
                 line_items.append({
-                    "line_id": line.id,
-                    "month": line.month,
-                    "category_name": line.category_id.name if line.category_id else None,
-                    "product_name": line.product_id.display_name if line.product_id else None,
-                    "rate_type": line.rate_type,
-                    "unit_price": line.price_unit,
-                    "quantity": line.product_qty,
-                    "amount": line.amount,
+                    "line_id": line['id'],
+                    "month": line['month'],
+                    "category_name": batch.name('product.category', line['category_id']),
+                    "product_name": batch.name('product.template', line['product_id']),
+                    "rate_type": line['rate_type'],
+                    "unit_price": line['price_unit'],
+                    "quantity": line['product_qty'],
+                    "amount": line['amount'],
                 })
 
             visit_dict = {
-                "mr_doctor_id": visit.id,
-                "territory_id": visit.territory_id.id if visit.territory_id else None,
-                "territory_name": visit.territory_id.name if visit.territory_id.name else None,
-                "reference": visit.name,
-                "doctor_name": visit.doctor_id.name,
-                "status": visit.asm_state,
+                "mr_doctor_id": visit['id'],
+                "territory_id": visit['territory_id'] or None,
+                "territory_name": batch.name('territory.name', visit['territory_id']),
+                "reference": visit['name'],
+                "doctor_name": batch.name('res.partner', visit['doctor_id']) or False,
+                "status": visit['asm_state'],
                 "lines": line_items
             }
 
             # Add rejection reason only if rejected
-            if visit.asm_state == 'rejected':
-                visit_dict["rejection_reason"] = visit.rejection_reason or ""
+            if visit['asm_state'] == 'rejected':
+                visit_dict["rejection_reason"] = visit['rejection_reason'] or ""
 
             visits_data.append(visit_dict)
 
-        return Response(json.dumps({
+        return json_response({
             "success": True,
             "count": len(visits_data),
             "visits": visits_data
-        }, default=str), content_type='application/json')
+        }, etag=etag)
 
 ############### API to check if today's first record for MR: For showing declaration text only once in a day ##########################
 class MRFirstRecordCheckAPI(http.Controller):
@@ -988,43 +1410,52 @@ class MRDoctorEditAPI(http.Controller):
     def edit_mr_doctor_visit(self, **kwargs):
         """
         API to edit an existing MR doctor visit record.
-        Uses line index instead of line_id.
+        Accepts the line_*[index] form fields or an application/json body
+        with a "lines" array, as /create_mr_doctor_visit_record.
+
+        Lines carry no line_id; each submitted line is matched to an existing one:
+            - the line with the same product and month is updated, wherever it is
+              in the list (reordered or swapped lines are fine);
+            - the other submitted lines update the remaining existing lines, in
+              the order they were created;
+            - submitted lines left over are created. Existing lines left over are
+              kept unchanged.
+        A submitted line without month takes the month of the existing line at
+        the same index.
         """
 
         try:
+            kwargs, visit, error_response = read_visit_payload(
+                kwargs, schema=VISIT_EDIT_SCHEMA, require_lines=False)
+            if error_response:
+                return error_response
+
             # Validate token & user
             user, error_response = validate_api_request(request, kwargs)
             if error_response:
                 return error_response
 
             # Employee validation
-            employee = request.env['hr.employee'].sudo().search(
-                [('user_id', '=', user.id)], limit=1)
+            profile = get_employee_profile(user)
 
-            if not employee:
+            if not profile:
                 return Response(json.dumps({
                     "success": False,
                     "message": "Employee not linked to this user"
                 }), content_type='application/json')
 
-            if employee.job_id.name not in ['MR', 'ASM', 'RSM', 'ZSM', 'ISM']:
+            if profile.job_name not in ['MR', 'ASM', 'RSM', 'ZSM', 'ISM']:
                 return Response(json.dumps({
                     "success": False,
                     "message": "Only MR, ASM, RSM, ZSM and ISM can edit visit records"
                 }), content_type='application/json')
 
             # Parameters
-            mr_doctor_id = kwargs.get('mr_doctor_id')
-            territory_id = kwargs.get('territory_id')
-            doctor_id = kwargs.get('doctor_id')
+            mr_doctor_id = visit['mr_doctor_id']
+            territory_id = visit['territory_id']
+            doctor_id = visit['doctor_id']
 
-            if not mr_doctor_id:
-                return Response(json.dumps({
-                    "success": False,
-                    "message": "mr_doctor_id is required"
-                }), content_type='application/json')
-
-            mr_doctor = request.env['mr.doctor'].sudo().browse(int(mr_doctor_id))
+            mr_doctor = request.env['mr.doctor'].sudo().browse(mr_doctor_id)
 
             if not mr_doctor.exists():
                 return Response(json.dumps({
@@ -1052,7 +1483,7 @@ class MRDoctorEditAPI(http.Controller):
 
             # Territory validation
             if territory_id:
-                if int(territory_id) not in employee.territory_ids.ids:
+                if territory_id not in profile.territory_ids:
                     return Response(json.dumps({
                         "success": False,
                         "message": "Territory not assigned to you"
@@ -1060,99 +1491,72 @@ class MRDoctorEditAPI(http.Controller):
 
             # Doctor validation
             if doctor_id:
-                doctor = request.env['res.partner'].sudo().browse(int(doctor_id))
+                doctor = request.env['res.partner'].sudo().browse(doctor_id)
                 if not doctor.is_doctor:
                     return Response(json.dumps({
                         "success": False,
                         "message": "Invalid doctor"
                     }), content_type='application/json')
 
-            # Update header
-            header_vals = {}
-
-            if territory_id:
-                header_vals['territory_id'] = int(territory_id)
-
-            if doctor_id:
-                header_vals['doctor_id'] = int(doctor_id)
-                doctor = request.env['res.partner'].sudo().browse(int(doctor_id))
-                header_vals['doc_unique_id'] = doctor.doc_unique_id
-
-            if header_vals:
-                mr_doctor.write(header_vals)
-
             # Existing lines ordered
             existing_lines = mr_doctor.line_ids.sorted('id')
 
-            index = 0
             territory_id_to_use = territory_id or mr_doctor.territory_id.id
 
-            while True:
+            # A line without month keeps the month of the line it replaces
+            for line, existing_line in zip(visit['lines'], existing_lines):
+                line['month'] = line['month'] or existing_line.month
 
-                category_id = kwargs.get(f'line_category_id[{index}]')
-                product_id = kwargs.get(f'line_product_id[{index}]')
-
-                if not category_id or not product_id:
-                    break
-
-                rate_type = kwargs.get(f'line_rate_type[{index}]')
-                qty = float(kwargs.get(f'line_qty[{index}]', 1))
-                price = float(kwargs.get(f'line_price[{index}]', 0))
-                # month = kwargs.get(f'line_month[{index}]') or datetime.today().strftime('%Y-%m')
-                existing_month = existing_lines[index].month if index < len(existing_lines) else None
-
-                month = kwargs.get(f'line_month[{index}]') or existing_month or datetime.today().strftime('%Y-%m')
-
-                product = request.env['product.template'].sudo().browse(int(product_id))
-
-                if not product.exists():
-                    return Response(json.dumps({
-                        "success": False,
-                        "message": f"Invalid product_id: {product_id}"
-                    }), content_type='application/json')
-
-                # Territory validation
-                if product.is_territory_specific_product:
-                    if int(territory_id_to_use) not in product.allowed_territory_ids.ids:
-                        return Response(json.dumps({
-                            "success": False,
-                            "message": f"Product '{product.display_name}' is not allowed in the selected territory"
-                        }), content_type='application/json')
-
-                if rate_type not in ['ptr_rate', 'custom_rate']:
-                    return Response(json.dumps({
-                        "success": False,
-                        "message": f"Invalid rate type at line {index}"
-                    }), content_type='application/json')
-
-                if rate_type == 'ptr_rate':
-                    price = product.list_price
-
-                if rate_type == 'custom_rate' and price > product.list_price:
-                    return Response(json.dumps({
-                        "success": False,
-                        "message": f"Custom price cannot exceed PTR rate for product {product.display_name}"
-                    }), content_type='application/json')
+            try:
+                line_updates = check_visit_lines(
+                    load_products(request.env, [line['product_id'] for line in visit['lines']]),
+                    load_months(request.env), territory_id_to_use, visit['lines'])
+            except PayloadError as e:
+                return Response(json.dumps({
+                    "success": False,
+                    "message": str(e)
+                }), content_type='application/json')
+            for line_vals in line_updates:
+                line_vals['mr_doctor_id'] = mr_doctor.id
+
+            # Duplicate check of all the submitted lines against the MR's other visits, in one query
+            Line = request.env['mr.doctor.line'].sudo()
+            doctor_id_to_use = doctor_id or mr_doctor.doctor_id.id
+            keys = [(doctor_id_to_use, vals['product_id'], vals['month']) for vals in line_updates]
+            duplicates = Line._get_existing_line_keys(user.id, keys, exclude_visit_id=mr_doctor.id)
+            duplicates |= {key for key in keys if keys.count(key) > 1}
+            if duplicates:
+                _doctor_id, product_id, month = next(key for key in keys if key in duplicates)
+                return Response(json.dumps({
+                    "success": False,
+                    "message": f"Duplicate entry: Product '{Line.env['product.template'].browse(product_id).display_name}' in month {month} already exists for this doctor. Duplicate records are not allowed."
+                }), content_type='application/json')
 
-                line_vals = {
-                    'mr_doctor_id': mr_doctor.id,
-                    'category_id': int(category_id),
-                    'product_id': product.id,
-                    'rate_type': rate_type,
-                    'price_unit': price,
-                    'product_qty': qty,
-                    'month': month,
-                }
+            # Update header, only once the lines are known to be valid
+            header_vals = {}
 
-                # UPDATE USING INDEX
-                if index < len(existing_lines):
-                    existing_lines[index].sudo().write(line_vals)
+            if territory_id:
+                header_vals['territory_id'] = territory_id
 
-                # CREATE NEW LINE
-                else:
-                    request.env['mr.doctor.line'].sudo().create(line_vals)
+            if doctor_id:
+                header_vals['doctor_id'] = doctor_id
+                header_vals['doc_unique_id'] = doctor.doc_unique_id
 
-                index += 1
+            # Header and lines are saved together or not at all
+            try:
+                with request.env.cr.savepoint():
+                    if header_vals:
+                        mr_doctor.write(header_vals)
+
+                    # UPDATE the lines, matched on product and month, CREATE the extra lines
+                    mr_doctor._update_lines(line_updates)
+            except IntegrityError as e:
+                if not Line._is_duplicate_line_error(e):
+                    raise
+                return Response(json.dumps({
+                    "success": False,
+                    "message": "Duplicate entry: these products are already recorded for this doctor and month. Duplicate records are not allowed."
+                }), content_type='application/json')
 
             # Workflow
             # if not user.has_group('base.group_system'):
@@ -1206,16 +1610,15 @@ class MRDoctorDeleteAPI(http.Controller):
                 return error_response
 
             # Employee validation
-            employee = request.env['hr.employee'].sudo().search(
-                [('user_id', '=', user.id)], limit=1)
+            profile = get_employee_profile(user)
 
-            if not employee:
+            if not profile:
                 return Response(json.dumps({
                     "success": False,
                     "message": "Employee not linked to this user"
                 }), content_type='application/json')
 
-            if employee.job_id.name not in ['MR', 'ASM', 'RSM', 'ZSM', 'ISM']:
+            if profile.job_name not in ['MR', 'ASM', 'RSM', 'ZSM', 'ISM']:
                 return Response(json.dumps({
                     "success": False,
                     "message": "Only MR, ASM, RSM, ZSM and ISM can delete visit records"
@@ -1309,11 +1712,49 @@ class MRDoctorDeleteAPI(http.Controller):
                 "message": str(e)
             }), content_type='application/json')
 
+# Dashboard buckets of /manager_dashboard_visits and the states they hold
+DASHBOARD_BUCKETS = {
+    'submitted': ['submitted'],
+    'processed': ['verified', 'rejected'],
+}
+# Latest visits returned per bucket by the dashboard summary
+DASHBOARD_TOP_N = 10
+
+def dashboard_visit_dict(batch, visit):
+    """ Manager dashboard entry of a visit header loaded by VisitBatch """
+    visit_dict = {
+        "mr_doctor_id": visit['id'],
+        "reference": visit['name'],
+        "mr_id": visit['mr_id'] or None,
+        "mr_name": batch.name('res.users', visit['mr_id']),
+        "doctor_name": batch.name('res.partner', visit['doctor_id']),
+        "territory_name": batch.name('territory.name', visit['territory_id']),
+        "status": visit['asm_state'],
+        "create_date": visit['create_date'].strftime('%Y-%m-%d %H:%M:%S') if visit['create_date'] else None,
+    }
+
+    # Add rejection reason if rejected
+    if visit['asm_state'] == 'rejected':
+        visit_dict['rejection_reason'] = visit['rejection_reason'] or ""
+    return visit_dict
+
 ########## API for Manager Dashboard: Display records count ##########################
 class ManagerDashboardVisitsAPI(http.Controller):
 
     @http.route('/manager_dashboard_visits', type='http', auth='public', cors='*', methods=['POST'], csrf=False)
     def get_manager_dashboard_visits(self, **kwargs):
+        """
+        Visits of the MRs reporting to the manager.
+
+        Without parameters every visit is returned, split into submitted and
+        processed lists. Dashboard mode (summary=1, or bucket=...) only returns
+        database aggregates and short pages instead:
+            - summary=1: counts by state, by MR and by month, plus the ``limit``
+              (default DASHBOARD_TOP_N) latest visits of each bucket
+            - bucket: 'submitted' or 'processed', one page of that bucket (drill-down)
+            - cursor: next cursor of the previous page of the bucket
+            - mr_id: restrict the pages to one MR of the team
+        """
 
         try:
             # Validate token
@@ -1329,22 +1770,19 @@ class ManagerDashboardVisitsAPI(http.Controller):
             #     }), content_type='application/json')
 
             # Get manager employee
-            manager_employee = request.env['hr.employee'].sudo().search(
-                [('user_id', '=', user.id)], limit=1)
+            manager_profile = get_employee_profile(user)
 
-            if not manager_employee:
+            if not manager_profile:
                 return Response(json.dumps({
                     "success": False,
                     "message": "Manager employee record not found"
                 }), content_type='application/json')
 
-            # Get MRs under this manager
-            mr_employees = request.env['hr.employee'].sudo().search([
-                ('parent_id', '=', manager_employee.id),
-                ('user_id', '!=', False)
-            ])
+            # Get MRs under this manager, at any depth
+            mr_user_ids = request.env['hr.employee'].sudo()._get_team_user_ids(user.id)
 
-            mr_user_ids = mr_employees.mapped('user_id').ids
+            if parse_bool(kwargs.get('summary'), default=False) or kwargs.get('bucket'):
+                return self._dashboard_summary(mr_user_ids, kwargs)
 
             if not mr_user_ids:
                 return Response(json.dumps({
@@ -1363,28 +1801,17 @@ class ManagerDashboardVisitsAPI(http.Controller):
             submitted_visits = []
             processed_visits = []
 
-            for visit in visits:
-
-                visit_dict = {
-                    "mr_doctor_id": visit.id,
-                    "reference": visit.name,
-                    "mr_id": visit.mr_id.id if visit.mr_id else None,
-                    "mr_name": visit.mr_id.name if visit.mr_id else None,
-                    "doctor_name": visit.doctor_id.name if visit.doctor_id else None,
-                    "territory_name": visit.territory_id.name if visit.territory_id else None,
-                    "status": visit.asm_state,
-                    "create_date": visit.create_date.strftime('%Y-%m-%d %H:%M:%S') if visit.create_date else None,
-                }
+            batch = VisitBatch(visits, include_lines=False)
 
-                # Add rejection reason if rejected
-                if visit.asm_state == 'rejected':
-                    visit_dict['rejection_reason'] = visit.rejection_reason or ""
+            for visit in batch.headers:
+
+                visit_dict = dashboard_visit_dict(batch, visit)
 
                 # Categorize records
-                if visit.asm_state == 'submitted':
+                if visit['asm_state'] == 'submitted':
                     submitted_visits.append(visit_dict)
 
-                elif visit.asm_state in ['verified', 'rejected']:
+                elif visit['asm_state'] in ['verified', 'rejected']:
                     processed_visits.append(visit_dict)
 
             return Response(json.dumps({
@@ -1402,3 +1829,94 @@ class ManagerDashboardVisitsAPI(http.Controller):
                 "message": str(e)
             }), content_type='application/json')
 
+    def _dashboard_summary(self, mr_user_ids, kwargs):
+        """ Dashboard mode of /manager_dashboard_visits: a fixed number of
+        queries whatever the number of visits of the team """
+        bucket = kwargs.get('bucket')
+        try:
+            limit = min(int(kwargs.get('limit') or DASHBOARD_TOP_N), MAX_PAGE_SIZE)
+            cursor = kwargs.get('cursor')
+            if cursor:
+                request.env['mr.doctor']._parse_visit_cursor(cursor)
+            mr_id = int(kwargs['mr_id']) if kwargs.get('mr_id') else None
+        except ValueError:
+            return Response(json.dumps({
+                "success": False,
+                "message": "Invalid limit, cursor or mr_id value"
+            }), content_type='application/json')
+
+        if limit <= 0:
+            return Response(json.dumps({
+                "success": False,
+                "message": "limit must be greater than zero"
+            }), content_type='application/json')
+
+        if bucket and bucket not in DASHBOARD_BUCKETS:
+            return Response(json.dumps({
+                "success": False,
+                "message": f"bucket must be one of: {', '.join(DASHBOARD_BUCKETS)}"
+            }), content_type='application/json')
+
+        if mr_id:
+            if mr_id not in mr_user_ids:
+                return Response(json.dumps({
+                    "success": False,
+                    "message": "This MR does not report to you"
+                }), content_type='application/json')
+            mr_user_ids = [mr_id]
+
+        MrDoctor = request.env['mr.doctor'].sudo()
+        pages = {
+            name: MrDoctor._get_visit_page(mr_user_ids, limit=limit, cursor=cursor, states=DASHBOARD_BUCKETS[name])
+            for name in ([bucket] if bucket else DASHBOARD_BUCKETS)
+        }
+
+        # One batch (a read per model) for the visits of every page
+        all_visits = MrDoctor.browse()
+        for visits, _next_cursor in pages.values():
+            all_visits |= visits
+        batch = VisitBatch(all_visits, include_lines=False)
+        headers = {visit['id']: visit for visit in batch.headers}
+
+        def page_items(visits):
+            return [dashboard_visit_dict(batch, headers[visit_id]) for visit_id in visits.ids]
+
+        if bucket:
+            visits, next_cursor = pages[bucket]
+            return Response(json.dumps({
+                "success": True,
+                "bucket": bucket,
+                "visits": page_items(visits),
+                "next_cursor": next_cursor,
+                "has_more": bool(next_cursor),
+            }), content_type='application/json')
+
+        counts = MrDoctor._get_dashboard_counts(mr_user_ids)
+        mr_names = {
+            mr['id']: mr['name']
+            for mr in request.env['res.users'].sudo().browse(list(counts['by_mr'])).read(['name'])
+        }
+
+        def bucket_count(state_counts, name):
+            return sum(state_counts.get(state, 0) for state in DASHBOARD_BUCKETS[name])
+
+        response = {
+            "success": True,
+            "submitted_count": bucket_count(counts['by_state'], 'submitted'),
+            "processed_count": bucket_count(counts['by_state'], 'processed'),
+            "counts_by_state": counts['by_state'],
+            "counts_by_mr": [{
+                "mr_id": mr,
+                "mr_name": mr_names.get(mr),
+                "counts": state_counts,
+            } for mr, state_counts in counts['by_mr'].items()],
+            "counts_by_month": [{
+                "month": month,
+                "counts": counts['by_month'][month],
+            } for month in sorted(counts['by_month'], reverse=True)],
+        }
+        for name, (visits, next_cursor) in pages.items():
+            response[f"{name}_visits"] = page_items(visits)
+            response[f"{name}_next_cursor"] = next_cursor
+        return Response(json.dumps(response), content_type='application/json')
+
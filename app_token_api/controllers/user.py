@@ -1,8 +1,7 @@
 from odoo.http import request, Response
 from odoo import http
 import json
-from datetime import datetime , timedelta
-import secrets
+from datetime import datetime
 from .token import validate_api_request
 import logging
 _logger = logging.getLogger(__name__)
@@ -57,8 +56,10 @@ class UserController(http.Controller):
             _logger.info("Password verified successfully for user_id=%s", user.id)
 
 
-            # 🔎 Find employee linked with this user
-            employee = request.env['hr.employee'].sudo().search([('user_id', '=', user.id)], limit=1)
+            # 🔎 Find employee linked with this user (cached profile, see hr.employee._get_employee_profile)
+            Employee = request.env['hr.employee'].sudo()
+            profile = Employee._get_employee_profile(user.id)
+            employee = Employee.browse(profile.employee_id if profile else [])
             
             # if not employee.job_id or employee.job_id.name != 'MR':
             #     return Response(json.dumps({
@@ -68,7 +69,7 @@ class UserController(http.Controller):
 
             allowed_roles = ['MR', 'ASM', 'RSM', 'ZSM', 'ISM']
 
-            if not employee.job_id or employee.job_id.name not in allowed_roles:
+            if not profile or profile.job_name not in allowed_roles:
                 return Response(json.dumps({
                     "success": False,
                     "message": "Access denied. Your account is not assigned to the required roles for login."
@@ -82,13 +83,8 @@ class UserController(http.Controller):
             else:
                 _logger.info("Device token unchanged for user_id=%s", user.id)
 
-            token = secrets.token_hex(32)
-            access_token_dict = {
-                'user_id': user.id,
-                'api_key': token,
-                'expiry_date': datetime.now() + timedelta(days=7)
-            }
-            create_access_token = request.env['partner.api.key'].sudo().create(access_token_dict)
+            # Only the hash of the token is stored
+            access_token = request.env['partner.api.key'].sudo()._generate_api_key(user)
 
             # ✅ Build employee details (compact)
             employee_data = {
@@ -132,7 +128,7 @@ class UserController(http.Controller):
                 'email': user.login,
                 'role': employee.job_id.name,
                 'employee': employee_data,
-                'access_token': create_access_token.api_key,
+                'access_token': access_token,
             }), content_type='application/json')
 
         except Exception as e:
@@ -152,7 +148,8 @@ class UserController(http.Controller):
             return error_response
 
         # 🔎 User સાથે જોડાયેલ employee
-        employee = request.env['hr.employee'].sudo().search([('user_id', '=', user.id)], limit=1)
+        profile = request.env['hr.employee'].sudo()._get_employee_profile(user.id)
+        employee = request.env['hr.employee'].sudo().browse(profile.employee_id if profile else [])
         if not employee:
             return Response(json.dumps({
                 "success": False,
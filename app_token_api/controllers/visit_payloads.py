@@ -0,0 +1,209 @@
+from datetime import datetime
+import json
+import math
+
+RATE_TYPES = ('ptr_rate', 'custom_rate')
+
+# Upper bound for the number of visits accepted by one bulk submission
+MAX_BULK_VISITS = 100
+
+
+class PayloadError(ValueError):
+    """ Invalid visit payload; the message is sent back to the app as is """
+
+
+def _to_int(value):
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(value)
+    return int(value)
+
+
+def _to_float(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    value = float(value)
+    # float() also accepts "nan" and "inf"
+    if not math.isfinite(value):
+        raise ValueError(value)
+    return value
+
+
+def _to_non_negative_float(value):
+    value = _to_float(value)
+    if value < 0:
+        raise ValueError(value)
+    return value
+
+
+def _to_month(value):
+    # Stored as 'YYYY-MM'
+    return datetime.strptime(str(value), '%Y-%m').strftime('%Y-%m')
+
+
+def _to_rate_type(value):
+    if value not in RATE_TYPES:
+        raise ValueError(value)
+    return value
+
+
+def _to_str(value):
+    if not isinstance(value, (str, int)):
+        raise ValueError(value)
+    return str(value).strip()
+
+
+# key: (converter, required)
+VISIT_SCHEMA = {
+    'client_ref': (_to_str, False),
+    'territory_id': (_to_int, True),
+    'doctor_id': (_to_int, True),
+}
+# Edition of an existing visit: only the given header values are changed
+VISIT_EDIT_SCHEMA = {
+    'mr_doctor_id': (_to_int, True),
+    'territory_id': (_to_int, False),
+    'doctor_id': (_to_int, False),
+}
+LINE_SCHEMA = {
+    'category_id': (_to_int, True),
+    'product_id': (_to_int, True),
+    'rate_type': (_to_rate_type, True),
+    'qty': (_to_non_negative_float, False),
+    'price': (_to_non_negative_float, False),
+    'month': (_to_month, False),
+}
+
+
+def _apply_schema(data, schema, where=''):
+    """ Check and convert the keys of ``schema`` in ``data``; missing optional keys are None """
+    if not isinstance(data, dict):
+        raise PayloadError(f"Invalid payload{where}: an object is expected")
+    values = {}
+    for key, (convert, required) in schema.items():
+        raw = data.get(key)
+        if raw is None or raw == '':
+            if required:
+                raise PayloadError(f"{key} is required{where}")
+            values[key] = None
+            continue
+        try:
+            values[key] = convert(raw)
+        except (TypeError, ValueError):
+            raise PayloadError(f"Invalid {key}{where}") from None
+    return values
+
+
+def parse_json(raw, name):
+    """ Decode the JSON parameter ``name`` """
+    if raw in (None, ''):
+        raise PayloadError(f"{name} is required")
+    if not isinstance(raw, (str, bytes)):
+        return raw
+    try:
+        return json.loads(raw)
+    except ValueError:
+        raise PayloadError(f"{name} is not valid JSON") from None
+
+
+def read_json_body(httprequest):
+    """ Decoded body of a request sent as application/json, None for a form request """
+    if httprequest.mimetype != 'application/json':
+        return None
+    data = parse_json(httprequest.get_data(as_text=True), 'Request body')
+    if not isinstance(data, dict):
+        raise PayloadError("The request body must be a JSON object")
+    return data
+
+
+def parse_form_lines(kwargs):
+    """ Lines sent as line_category_id[0], line_product_id[0]... form fields, in the
+    format of the JSON ``lines`` array; the first index without division or product ends the list """
+    lines = []
+    index = 0
+    while kwargs.get(f'line_category_id[{index}]') and kwargs.get(f'line_product_id[{index}]'):
+        lines.append({
+            'category_id': kwargs.get(f'line_category_id[{index}]'),
+            'product_id': kwargs.get(f'line_product_id[{index}]'),
+            'rate_type': kwargs.get(f'line_rate_type[{index}]'),
+            'qty': kwargs.get(f'line_qty[{index}]'),
+            'price': kwargs.get(f'line_price[{index}]'),
+            'month': kwargs.get(f'line_month[{index}]'),
+        })
+        index += 1
+    return lines
+
+
+def parse_visit_line(data, index):
+    line = _apply_schema(data, LINE_SCHEMA, f" at line {index}")
+    if line['qty'] is None:
+        line['qty'] = 1.0
+    if line['price'] is None:
+        line['price'] = 0.0
+    return line
+
+
+def parse_visit(data, require_client_ref=False, require_lines=True, schema=VISIT_SCHEMA):
+    """ Check a visit object and its ``lines``; raises PayloadError on the first problem """
+    visit = _apply_schema(data, schema)
+    if require_client_ref and not visit['client_ref']:
+        raise PayloadError("client_ref is required")
+
+    lines = data.get('lines') or []
+    if not isinstance(lines, list):
+        raise PayloadError("lines must be a list")
+    visit['lines'] = [parse_visit_line(line, index) for index, line in enumerate(lines)]
+    if require_lines and not visit['lines']:
+        raise PayloadError("At least one product is required")
+    return visit
+
+
+def load_products(env, product_ids):
+    """ Product data needed to check visit lines, for all ``product_ids`` in one read """
+    products = env['product.template'].sudo().browse(list(set(product_ids))).exists()
+    return {
+        product['id']: product
+        for product in products.read(
+            ['display_name', 'list_price', 'is_territory_specific_product', 'allowed_territory_ids'])
+    }
+
+
+def load_months(env):
+    """ Months a visit line can be saved for: the keys of the month selection of
+    mr.doctor.line, which only spans the months around today """
+    return frozenset(key for key, _label in env['mr.doctor.line']._get_month_year_selection())
+
+
+def check_visit_lines(products, months, territory_id, lines, default_month=None):
+    """ Check parsed ``lines`` against the ``products`` of load_products and the
+    ``months`` of load_months and return the mr.doctor.line values (without mr_doctor_id) """
+    default_month = default_month or datetime.today().strftime('%Y-%m')
+    line_vals = []
+    for index, line in enumerate(lines):
+        month = line['month'] or default_month
+        if month not in months:
+            raise PayloadError(f"Invalid month at line {index}: {month} is out of the allowed range")
+
+        product = products.get(line['product_id'])
+        if not product:
+            raise PayloadError(f"Invalid product_id: {line['product_id']}")
+
+        if product['is_territory_specific_product'] and territory_id not in product['allowed_territory_ids']:
+            raise PayloadError(f"Product '{product['display_name']}' is not allowed in the selected territory")
+
+        # PTR logic
+        price = line['price']
+        if line['rate_type'] == 'ptr_rate':
+            price = product['list_price']
+
+        if line['rate_type'] == 'custom_rate' and price > product['list_price']:
+            raise PayloadError(f"Custom price cannot exceed PTR rate for product {product['display_name']}")
+
+        line_vals.append({
+            'category_id': line['category_id'],
+            'product_id': product['id'],
+            'rate_type': line['rate_type'],
+            'price_unit': price,
+            'product_qty': line['qty'],
+            'month': month,
+        })
+    return line_vals
@@ -1,5 +1,80 @@
 from odoo import models, fields, api
 from odoo import http
+from odoo.tools.sql import column_exists
+from datetime import datetime, timedelta
+from collections import OrderedDict
+import hashlib
+import logging
+import secrets
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Seconds a cached token lookup is trusted before it is read again from the database
+TOKEN_CACHE_TTL = 60
+# Valid tokens kept per worker, least recently used dropped first
+TOKEN_CACHE_SIZE = 4096
+# Days a token issued at login stays valid
+TOKEN_VALIDITY_DAYS = 7
+
+
+def hash_api_key(token):
+    """ Keys are random 256-bit values, so a plain SHA-256 digest is enough to store them """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Worker-local cache of the valid tokens: {(dbname, key hash): (user id, expiry date, cached at)}.
+# It is kept apart from the registry ormcache so that issuing or revoking a key
+# does not flush the access rights, record rules and other caches of the registry.
+# Only valid tokens are stored, so a key created at login is never cached stale.
+# Revocations are signalled to every worker through a database sequence, see
+# PartnerApiKey._signal_token_revocation().
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+# Last value of the revocation sequence seen by this worker: {dbname: value}
+_token_cache_versions = {}
+# Sequence bumped after each committed revocation of keys
+TOKEN_REVOCATION_SEQUENCE = 'partner_api_key_revocation_seq'
+# cr.postcommit.data key of a revocation waiting to be signalled
+TOKEN_REVOCATION_KEY = 'partner.api.key.revocation'
+
+
+def _get_cached_token(key):
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            return None
+        if entry[2] + TOKEN_CACHE_TTL < time.monotonic():
+            del _token_cache[key]
+            return None
+        _token_cache.move_to_end(key)
+        return entry[:2]
+
+
+def _set_cached_token(key, user_id, expiry_date):
+    with _token_cache_lock:
+        _token_cache[key] = (user_id, expiry_date, time.monotonic())
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+
+def clear_token_cache(dbname):
+    """ Forget the cached tokens of a database in this worker """
+    with _token_cache_lock:
+        for key in [key for key in _token_cache if key[0] == dbname]:
+            del _token_cache[key]
+
+
+def _sync_token_cache(dbname, version):
+    """ Forget the cached tokens of a database when another worker revoked keys since """
+    with _token_cache_lock:
+        if _token_cache_versions.get(dbname) == version:
+            return
+        for key in [key for key in _token_cache if key[0] == dbname]:
+            del _token_cache[key]
+        _token_cache_versions[dbname] = version
 
 
 class PartnerApiKey(models.Model):
@@ -7,11 +82,116 @@ class PartnerApiKey(models.Model):
     _description = 'Partner API Key'
 
     user_id = fields.Many2one('res.users', string='User', required=True)
-    api_key = fields.Char(string='API Key', readonly=True)
-    expiry_date = fields.Datetime(string='Expiry Date', readonly=True)
+    api_key_hash = fields.Char(string='API Key Hash', readonly=True, copy=False)
+    expiry_date = fields.Datetime(string='Expiry Date', readonly=True, index=True)
+
+    def init(self):
+        cr = self.env.cr
+        # Hash the keys stored in clear text by earlier versions of the module
+        if column_exists(cr, self._table, 'api_key'):
+            cr.execute("""
+                UPDATE partner_api_key
+                   SET api_key_hash = encode(sha256(convert_to(api_key, 'UTF8')), 'hex'),
+                       api_key = NULL
+                 WHERE api_key IS NOT NULL
+            """)
+        # Unique lookup index that also covers the validation query (index-only scan)
+        cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS partner_api_key_hash_uniq
+                ON partner_api_key (api_key_hash) INCLUDE (user_id, expiry_date)
+        """)
+        cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {TOKEN_REVOCATION_SEQUENCE}")
+
+    @api.model
+    def _generate_api_key(self, user):
+        """ Create a key for ``user`` and return the clear token; only its hash is stored """
+        token = secrets.token_hex(32)
+        self.sudo().create({
+            'user_id': user.id,
+            'api_key_hash': hash_api_key(token),
+            'expiry_date': datetime.now() + timedelta(days=TOKEN_VALIDITY_DAYS),
+        })
+        return token
+
+    @api.model
+    def _signal_token_revocation(self):
+        """ Make every worker drop its cached tokens: this one at once, all of
+        them once the transaction is committed. Bumping the sequence earlier
+        would let another worker cache the key again before it is gone. """
+        cr = self.env.cr
+        clear_token_cache(cr.dbname)
+        if cr.postcommit.data.get(TOKEN_REVOCATION_KEY):
+            return
+        cr.postcommit.data[TOKEN_REVOCATION_KEY] = True
+        registry = self.env.registry
+
+        @cr.postcommit.add
+        def signal():
+            with registry.cursor() as signal_cr:
+                signal_cr.execute(f"SELECT nextval('{TOKEN_REVOCATION_SEQUENCE}')")
+            clear_token_cache(registry.db_name)
+
+    # A changed or deleted key leaves the token cache of every worker. A new key
+    # needs nothing: it cannot be cached yet.
+    def write(self, vals):
+        res = super().write(vals)
+        self._signal_token_revocation()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._signal_token_revocation()
+        return res
+
+    @api.model
+    def _get_token_user_id(self, token, user_id):
+        """ Return the id of the active user owning a valid ``token``, or False.
+        Served from the token cache, so a hit costs one read of the revocation
+        sequence instead of the key lookup. """
+        self.env.cr.execute(f"SELECT last_value FROM {TOKEN_REVOCATION_SEQUENCE}")
+        _sync_token_cache(self.env.cr.dbname, self.env.cr.fetchone()[0])
+        key = (self.env.cr.dbname, hash_api_key(token))
+        entry = _get_cached_token(key)
+        if entry is None:
+            entry = self._lookup_token(key[1])
+            if not entry:
+                return False
+            _set_cached_token(key, *entry)
+        owner_id, expiry_date = entry
+        if owner_id != user_id or expiry_date < datetime.now():
+            return False
+        return owner_id
+
+    @api.model
+    def _lookup_token(self, token_hash):
+        api_key = self.sudo().search([
+            ('api_key_hash', '=', token_hash),
+            ('user_id.active', '=', True),
+        ], order='expiry_date desc', limit=1)
+        if not api_key or not api_key.expiry_date:
+            return None
+        return api_key.user_id.id, api_key.expiry_date
+
+    @api.model
+    def _cron_purge_expired_keys(self):
+        """ Delete expired keys so the table does not grow with every login """
+        expired = self.sudo().search([('expiry_date', '<', datetime.now())])
+        _logger.info("Purging %s expired API keys", len(expired))
+        expired.unlink()
 
 class ResUsers(models.Model):
     _inherit = 'res.users'
 
     device_token = fields.Char(string="Device Token")
 
+    def write(self, vals):
+        res = super().write(vals)
+        # Deactivated users must stop passing the cached token check
+        if 'active' in vals:
+            self.env['partner.api.key']._signal_token_revocation()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['partner.api.key']._signal_token_revocation()
+        return res
@@ -0,0 +1 @@
+from . import test_visit_batch
@@ -0,0 +1,71 @@
+from datetime import date
+from unittest import SkipTest
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.app_token_api.controllers.serializers import VisitBatch
+
+# Headers, line search and read, one read per related model
+VISIT_BATCH_MAX_QUERIES = 10
+
+
+@tagged('post_install', '-at_install')
+class TestVisitBatch(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if 'mr.doctor' not in cls.env:
+            raise SkipTest("The visits come with ubik_app")
+        month = date.today().strftime('%Y-%m')
+        cls.mr = cls.env['res.users'].create({'name': 'Test MR', 'login': 'test_mr_visit_batch'})
+        category = cls.env['product.category'].create({'name': 'Test Division'})
+        visits = []
+        for index in range(5):
+            territory = cls.env['territory.name'].create({'name': f'Territory {index}'})
+            doctor = cls.env['res.partner'].create({
+                'name': f'Doctor {index}',
+                'is_doctor': True,
+                'territory_id': [(6, 0, territory.ids)],
+            })
+            products = cls.env['product.template'].create([
+                {'name': f'Product {index}-{rank}', 'categ_id': category.id, 'list_price': 10.0}
+                for rank in range(2)
+            ])
+            visits.append({
+                'mr_id': cls.mr.id,
+                'doctor_id': doctor.id,
+                'territory_id': territory.id,
+                'line_ids': [(0, 0, {
+                    'category_id': category.id,
+                    'product_id': product.id,
+                    'month': month,
+                    'product_qty': 1.0,
+                    'price_unit': product.list_price,
+                }) for product in products],
+            })
+        cls.visits = cls.env['mr.doctor'].create(visits)
+
+    def _count_queries(self, visits):
+        self.env.invalidate_all()
+        start = self.env.cr.sql_log_count
+        VisitBatch(visits)
+        return self.env.cr.sql_log_count - start
+
+    def test_query_count(self):
+        """ Serializing N visits costs the same queries as serializing one """
+        # Warm the access rights and rules caches
+        VisitBatch(self.visits)
+
+        single = self._count_queries(self.visits[:1])
+        self.assertLessEqual(single, VISIT_BATCH_MAX_QUERIES)
+
+        self.env.invalidate_all()
+        with self.assertQueryCount(single):
+            batch = VisitBatch(self.visits)
+
+        self.assertEqual(len(batch.headers), len(self.visits))
+        for header in batch.headers:
+            self.assertEqual(len(batch.lines(header)), 2)
+            self.assertTrue(batch.name('res.partner', header['doctor_id']))
+            self.assertTrue(batch.name('product.template', batch.lines(header)[0]['product_id']))
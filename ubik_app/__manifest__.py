@@ -10,6 +10,7 @@
         'security/ir.model.access.csv',
         'security/security.xml',
         'data/sequence.xml',
+        'data/ir_cron.xml',
         'wizard/asm_reject_wizard.xml',
        
         'views/mr_doctor_views.xml',
@@ -1,7 +1,10 @@
 import json
 import os
+import threading
 import requests
 import logging
+from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
 from google.oauth2 import service_account
 import google.auth.transport.requests
 
@@ -13,22 +16,111 @@ JSON_FILE = os.path.join(BASE_DIR, 'ubik-connect-firebase-adminsdk-fbsvc-5ef6bb9
 SCOPES = ['https://www.googleapis.com/auth/firebase.messaging']
 PROJECT_ID = "ubik-connect"
 
+# UBIK_FCM_SEND_URL points the sends at a local stand-in for FCM (tests, benchmarks)
+FCM_SEND_URL = os.environ.get('UBIK_FCM_SEND_URL') or \
+    f'https://fcm.googleapis.com/v1/projects/{PROJECT_ID}/messages:send'
+
+# Instance ID API managing the topic subscriptions of device tokens
+FCM_IID_URL = os.environ.get('UBIK_FCM_IID_URL') or 'https://iid.googleapis.com/iid/v1'
+# Most registration tokens accepted by one batchAdd / batchRemove call
+IID_BATCH_SIZE = 1000
+# Per-token errors of batchAdd / batchRemove meaning the token is unknown to FCM
+IID_INVALID_TOKEN_ERRORS = {'NOT_FOUND'}
+
+# The OAuth token is renewed this long before it expires
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# Keep-alive connections kept open to the FCM endpoint
+FCM_POOL_SIZE = 10
+
+
+class _CredentialHolder:
+    """Process-wide service account credentials.
+
+    The JSON file is read once and the OAuth token is reused until shortly
+    before it expires; only one thread refreshes it, the others wait for it.
+    """
+
+    def __init__(self, json_file, scopes):
+        self._json_file = json_file
+        self._scopes = scopes
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        credentials = self._credentials
+        # google-auth keeps the expiry as a naive UTC datetime
+        return bool(
+            credentials and credentials.token and credentials.expiry
+            and credentials.expiry - TOKEN_REFRESH_MARGIN > datetime.utcnow()
+        )
+
+    def get_token(self):
+        if not self._is_fresh():
+            with self._lock:
+                if not self._is_fresh():
+                    if self._credentials is None:
+                        self._credentials = service_account.Credentials.from_service_account_file(
+                            self._json_file, scopes=self._scopes
+                        )
+                    self._credentials.refresh(google.auth.transport.requests.Request(session=_session))
+        return self._credentials.token
+
+    def invalidate(self):
+        """Force a refresh on next use, e.g. after FCM rejected the token"""
+        with self._lock:
+            if self._credentials is not None:
+                self._credentials.token = None
+
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=FCM_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Shared by every send of the process so TLS connections are reused
+_session = _build_session()
+_credential_holder = _CredentialHolder(JSON_FILE, SCOPES)
+
 
 def get_access_token():
-    credentials = service_account.Credentials.from_service_account_file(
-        JSON_FILE, scopes=SCOPES
-    )
-    request = google.auth.transport.requests.Request()
-    credentials.refresh(request)
-    return credentials.token
+    return _credential_holder.get_token()
 
 
-def send_fcm_notification(device_token, title, body):
-    """Send push notification to a device token"""
+# Results of send_fcm_message
+FCM_SENT = 'sent'
+FCM_RETRY = 'retry'                    # transient error (network, quota, server), try again later
+FCM_INVALID_TOKEN = 'invalid_token'    # the device token is unknown to FCM, stop using it
+FCM_FAILED = 'failed'                  # FCM refused this message, sending it again would not help
 
-    access_token = get_access_token()
+# FCM error codes meaning the registration token will never work again
+INVALID_TOKEN_ERRORS = {'UNREGISTERED'}
+# FCM error codes meaning the message itself is wrong (bad payload, malformed
+# token...): only this message is given up, the device token is kept
+MESSAGE_ERRORS = {'INVALID_ARGUMENT'}
 
-    url = f'https://fcm.googleapis.com/v1/projects/{PROJECT_ID}/messages:send'
+
+def _fcm_error_code(response):
+    try:
+        details = response.json()['error'].get('details', [])
+    except Exception:
+        return None
+    for detail in details:
+        if detail.get('errorCode'):
+            return detail['errorCode']
+    return None
+
+
+def send_fcm_message(device_token, title, body, access_token=None, session=None, topic=None):
+    """Send a push notification to a device token, or to every device subscribed
+    to ``topic``, and return (result, error).
+
+    By default the cached OAuth token and the pooled module session are used.
+    """
+    access_token = access_token or get_access_token()
+    http = session or _session
 
     headers = {
         'Authorization': f'Bearer {access_token}',
@@ -37,19 +129,80 @@ def send_fcm_notification(device_token, title, body):
 
     message = {
         "message": {
-            "token": device_token,
             "notification": {
                 "title": title,
                 "body": body,
             }
         }
     }
+    if topic:
+        message["message"]["topic"] = topic
+    else:
+        message["message"]["token"] = device_token
 
-    response = requests.post(url, headers=headers, json=message)
+    try:
+        response = http.post(FCM_SEND_URL, headers=headers, json=message, timeout=10)
+    except requests.RequestException as e:
+        _logger.warning("FCM request failed: %s", e)
+        return FCM_RETRY, str(e)
 
     if response.status_code == 200:
-        _logger.info(f"FCM sent to token {device_token}")
-        return response.json()
-    else:
-        _logger.error(f"FCM Error: {response.status_code} - {response.text}")
-        return None
\ No newline at end of file
+        _logger.info("FCM sent to %s", f"topic {topic}" if topic else f"token {device_token}")
+        return FCM_SENT, None
+
+    error = f"{response.status_code} - {response.text}"
+    _logger.error(f"FCM Error: {error}")
+    if response.status_code == 401:
+        # Revoked or expired OAuth token: fetch a new one for the retry
+        _credential_holder.invalidate()
+        return FCM_RETRY, error
+    error_code = _fcm_error_code(response)
+    if not topic and (response.status_code == 404 or error_code in INVALID_TOKEN_ERRORS):
+        return FCM_INVALID_TOKEN, error
+    if response.status_code == 400 or error_code in MESSAGE_ERRORS:
+        return FCM_FAILED, error
+    return FCM_RETRY, error
+
+
+def update_fcm_topic(topic, device_tokens, subscribe=True):
+    """Subscribe (or unsubscribe) device tokens to a topic, IID_BATCH_SIZE tokens per call.
+
+    Returns (failed, rejected): the tokens that could not be (un)subscribed, to
+    try again later, and the tokens unknown to FCM, that will never work again.
+    """
+    action = 'batchAdd' if subscribe else 'batchRemove'
+    headers = {
+        'Authorization': f'Bearer {get_access_token()}',
+        'Content-Type': 'application/json',
+        'access_token_auth': 'true',
+    }
+    failed = []
+    rejected = []
+    for start in range(0, len(device_tokens), IID_BATCH_SIZE):
+        batch = device_tokens[start:start + IID_BATCH_SIZE]
+        try:
+            response = _session.post(f'{FCM_IID_URL}:{action}', headers=headers, json={
+                'to': f'/topics/{topic}',
+                'registration_tokens': batch,
+            }, timeout=30)
+        except requests.RequestException as e:
+            _logger.warning("FCM %s on topic %s failed: %s", action, topic, e)
+            failed += batch
+            continue
+        if response.status_code != 200:
+            _logger.error("FCM %s on topic %s: %s - %s", action, topic, response.status_code, response.text)
+            failed += batch
+            continue
+        # One result per token, in order; an 'error' key marks a token that was not done
+        for token, result in zip(batch, response.json().get('results', [])):
+            if result.get('error') in IID_INVALID_TOKEN_ERRORS:
+                rejected.append(token)
+            elif result.get('error'):
+                failed.append(token)
+    return failed, rejected
+
+
+def send_fcm_notification(device_token, title, body):
+    """Send push notification to a device token"""
+    result, _error = send_fcm_message(device_token, title, body)
+    return result == FCM_SENT
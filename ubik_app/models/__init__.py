@@ -1,8 +1,11 @@
 from . import mr_doctor
+from . import sales_report_view
 from . import doctorwise_sales_report
 from . import doctorwise_division_sales
 from . import yearwise_sales_comparison
 from . import productwise_yearly_comparison
 from . import final_sales_report
 from . import target_achievement
+from . import fcm_outbox
+from . import fcm_topic
 from . import product_notification
\ No newline at end of file
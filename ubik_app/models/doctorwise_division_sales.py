@@ -1,9 +1,10 @@
-from odoo import models, fields, tools
+from odoo import models, fields
 import logging
 _logger = logging.getLogger(__name__)
 
 class DoctorCategorySalesReport(models.Model):
     _name = 'doctor.division.sales.report'
+    _inherit = 'ubik.sales.report.view'
     _description = 'Doctor Wise Category Sales Report'
     _auto = False
     _rec_name = 'category_id'
@@ -34,43 +35,26 @@ class DoctorCategorySalesReport(models.Model):
     def init(self):
         # raise Exception("INIT IS RUNNING")
         _logger.info("CREATING VIEW doctor_division_sales_report")
-        tools.drop_view_if_exists(self.env.cr, self._table)
-        self.env.cr.execute("""
-
-        CREATE OR REPLACE VIEW doctor_division_sales_report AS (
+        self._create_report_view("""
 
         WITH base AS (
             SELECT
                 line.id,
-                doc.mr_id,
-                doc.doctor_id,
-                doc.territory_id,
+                line.mr_id,
+                line.doctor_id,
+                line.territory_id,
                 rp.doc_unique_id,
                 line.category_id,
 
                 -- Safe amount
                 COALESCE(NULLIF(line.amount::text, 'NaN')::numeric, 0) AS amount,
 
-                -- Precompute date
-                TO_DATE(line.month, 'YYYY-MM') AS month_date
+                -- Period columns stored on the line
+                line.month_num,
+                line.fy_start
 
             FROM mr_doctor_line line
-            JOIN mr_doctor doc ON doc.id = line.mr_doctor_id
-            JOIN res_partner rp ON rp.id = doc.doctor_id
-        ),
-
-        final AS (
-            SELECT
-                *,
-                EXTRACT(MONTH FROM month_date) AS month_num,
-
-                CASE
-                    WHEN EXTRACT(MONTH FROM month_date) >= 4
-                        THEN EXTRACT(YEAR FROM month_date)
-                    ELSE EXTRACT(YEAR FROM month_date) - 1
-                END AS fy_start
-
-            FROM base
+            JOIN res_partner rp ON rp.id = line.doctor_id
         )
 
         SELECT
@@ -110,7 +94,7 @@ class DoctorCategorySalesReport(models.Model):
 
             SUM(amount) AS amount
 
-        FROM final
+        FROM base
 
         GROUP BY
             mr_id,
@@ -120,5 +104,4 @@ class DoctorCategorySalesReport(models.Model):
             category_id,
             fy_start
 
-        )
         """)
\ No newline at end of file
@@ -1,10 +1,11 @@
-from odoo import models, fields, tools
+from odoo import models, fields
 import logging
 
 _logger = logging.getLogger(__name__)
 
 class MrDoctorSalesReport(models.Model):
     _name = 'mr.doctor.sales.report'
+    _inherit = 'ubik.sales.report.view'
     _description = 'Doctor Wise Sales Report'
     _auto = False
     _rec_name = 'doctor_id'  # Add a rec_name for better handling
@@ -16,8 +17,8 @@ class MrDoctorSalesReport(models.Model):
     def unlink(self):
         for rec in self:
             domain = [
-                ('mr_doctor_id.mr_id', '=', rec.mr_id.id),
-                ('mr_doctor_id.doctor_id', '=', rec.doctor_id.id),
+                ('mr_id', '=', rec.mr_id.id),
+                ('doctor_id', '=', rec.doctor_id.id),
                 ('category_id', '=', rec.category_id.id),
                 ('product_id', '=', rec.product_id.id),
                 ('rate_type', '=', rec.rate_type),
@@ -26,6 +27,8 @@ class MrDoctorSalesReport(models.Model):
             lines = self.env['mr.doctor.line'].search(domain)
             lines.unlink()
 
+        # Drop the deleted rows right away when the report is materialized
+        self._refresh_report_view()
         return True
     
     mr_id = fields.Many2one('res.users', string="MR Name", readonly=True)
@@ -71,17 +74,15 @@ class MrDoctorSalesReport(models.Model):
 
     def init(self):
         _logger.info("CREATING VIEW mr_doctor_sales_report")
-        tools.drop_view_if_exists(self.env.cr, self._table)
         
         # Optimized query using CTE approach similar to your working reference
-        self.env.cr.execute("""
-        CREATE OR REPLACE VIEW mr_doctor_sales_report AS (
+        self._create_report_view("""
             WITH base AS (
                 SELECT
                     line.id,
-                    doc.mr_id,
-                    doc.doctor_id,
-                    doc.territory_id,
+                    line.mr_id,
+                    line.doctor_id,
+                    line.territory_id,
                     rp.doc_unique_id,
                     line.category_id,
                     line.product_id,
@@ -92,27 +93,13 @@ class MrDoctorSalesReport(models.Model):
                     COALESCE(NULLIF(line.product_qty::text, 'NaN')::numeric, 0) AS product_qty,
                     COALESCE(NULLIF(line.amount::text, 'NaN')::numeric, 0) AS amount,
                     
-                    -- Precompute date
-                    TO_DATE(line.month, 'YYYY-MM') AS month_date
+                    -- Period columns stored on the line
+                    line.month_num,
+                    line.fy_start
                     
                 FROM mr_doctor_line line
-                INNER JOIN mr_doctor doc ON doc.id = line.mr_doctor_id
-                INNER JOIN res_partner rp ON rp.id = doc.doctor_id
+                INNER JOIN res_partner rp ON rp.id = line.doctor_id
                 WHERE line.product_qty IS NOT NULL  -- Filter out null rows for performance
-            ),
-            
-            final AS (
-                SELECT
-                    *,
-                    EXTRACT(MONTH FROM month_date) AS month_num,
-                    
-                    CASE
-                        WHEN EXTRACT(MONTH FROM month_date) >= 4
-                            THEN EXTRACT(YEAR FROM month_date)
-                        ELSE EXTRACT(YEAR FROM month_date) - 1
-                    END AS fy_start
-                    
-                FROM base
             )
             
             SELECT
@@ -171,7 +158,7 @@ class MrDoctorSalesReport(models.Model):
                 SUM(product_qty) AS product_qty,
                 SUM(amount) AS amount
                 
-            FROM final
+            FROM base
             GROUP BY
                 mr_id,
                 doctor_id,
@@ -182,5 +169,4 @@ class MrDoctorSalesReport(models.Model):
                 rate_type,
                 price_unit,
                 fy_start
-        )
         """)
\ No newline at end of file
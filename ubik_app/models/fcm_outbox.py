@@ -0,0 +1,159 @@
+from odoo import models, fields, api
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+
+from ..fcm_utils import get_access_token, send_fcm_message, FCM_SENT, FCM_INVALID_TOKEN, FCM_FAILED
+
+_logger = logging.getLogger(__name__)
+
+# Messages sent per cron run; a full batch re-triggers the cron for the rest
+OUTBOX_BATCH_SIZE = 500
+# Parallel HTTP requests to FCM
+OUTBOX_WORKERS = 8
+# Attempts before a message is given up, retried after 1, 2, 4, 8... minutes
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE_MINUTES = 1
+# Days sent and failed messages are kept
+OUTBOX_KEEP_DAYS = 7
+
+
+class FcmNotificationOutbox(models.Model):
+    _name = 'fcm.notification.outbox'
+    _description = 'Push Notification Outbox'
+    _order = 'next_attempt_date, id'
+
+    # Either a single device or every device subscribed to a topic
+    device_token = fields.Char()
+    topic = fields.Char()
+    title = fields.Char()
+    body = fields.Text()
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ], default='pending', required=True, index=True)
+    attempts = fields.Integer(default=0)
+    next_attempt_date = fields.Datetime(default=fields.Datetime.now, index=True)
+    last_error = fields.Text()
+
+    @api.model
+    def _enqueue(self, tokens, title, body):
+        """ Queue one message per device token. The rows belong to the current
+        transaction and the sending cron only runs after it commits, so saving a
+        record never waits on FCM and rolled back changes notify nobody. """
+        tokens = [token for token in tokens if token]
+        if not tokens:
+            return self.browse()
+        messages = self.sudo().create([{
+            'device_token': token,
+            'title': title,
+            'body': body,
+        } for token in tokens])
+        self.env.ref('ubik_app.ir_cron_send_fcm_outbox')._trigger()
+        return messages
+
+    @api.model
+    def _enqueue_topic(self, topic, title, body):
+        """ Queue one message for every device subscribed to ``topic`` """
+        message = self.sudo().create({
+            'topic': topic,
+            'title': title,
+            'body': body,
+        })
+        self.env.ref('ubik_app.ir_cron_send_fcm_outbox')._trigger()
+        return message
+
+    def _lock_pending_batch(self, limit):
+        """ Pending messages due now, locked so that concurrent runs skip them """
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT id
+              FROM fcm_notification_outbox
+             WHERE state = 'pending'
+               AND next_attempt_date <= (now() AT TIME ZONE 'UTC')
+             ORDER BY next_attempt_date, id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [limit])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _cron_send_notifications(self):
+        messages = self.sudo()._lock_pending_batch(OUTBOX_BATCH_SIZE)
+        if messages:
+            messages._send()
+            if len(messages) == OUTBOX_BATCH_SIZE:
+                self.env.ref('ubik_app.ir_cron_send_fcm_outbox')._trigger()
+        self._purge_old_messages()
+
+    def _send(self):
+        """ Send the messages in parallel and record the outcome """
+        payloads = self.read(['device_token', 'topic', 'title', 'body', 'attempts'])
+        access_token = get_access_token()
+
+        # Sends go through the pooled session of fcm_utils (sized for OUTBOX_WORKERS)
+        with ThreadPoolExecutor(max_workers=OUTBOX_WORKERS) as executor:
+            # The worker threads only do HTTP; the ORM is used from this thread alone
+            results = list(executor.map(
+                lambda p: send_fcm_message(p['device_token'], p['title'], p['body'], access_token,
+                                           topic=p['topic']),
+                payloads,
+            ))
+
+        sent_ids = []
+        failed = {}
+        invalid = {}
+        retry = {}
+        for payload, (result, error) in zip(payloads, results):
+            if result == FCM_SENT:
+                sent_ids.append(payload['id'])
+            elif result == FCM_INVALID_TOKEN:
+                invalid[payload['id']] = (payload['device_token'], error)
+            elif result == FCM_FAILED:
+                failed[payload['id']] = error
+            else:
+                retry.setdefault(payload['attempts'] + 1, []).append((payload['id'], error))
+
+        if sent_ids:
+            self.browse(sent_ids).write({'state': 'sent', 'last_error': False})
+
+        # Rejected messages are not sent again, their device token stays in use
+        for message_id, error in failed.items():
+            self.browse(message_id).write({'state': 'failed', 'last_error': error})
+
+        for message_id, (_token, error) in invalid.items():
+            self.browse(message_id).write({'state': 'failed', 'last_error': error})
+        if invalid:
+            # Forget the dead tokens so that no further message is queued for them
+            tokens = list({token for token, _error in invalid.values()})
+            users = self.env['res.users'].sudo().with_context(active_test=False).search([
+                ('device_token', 'in', tokens),
+            ])
+            users.write({'device_token': False})
+            _logger.info("Cleared %s invalid FCM device tokens", len(users))
+
+        now = fields.Datetime.now()
+        next_retry_date = None
+        for attempts, entries in retry.items():
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                vals = {'state': 'failed', 'attempts': attempts}
+            else:
+                delay = timedelta(minutes=OUTBOX_RETRY_BASE_MINUTES * 2 ** (attempts - 1))
+                vals = {'attempts': attempts, 'next_attempt_date': now + delay}
+                next_retry_date = min(next_retry_date or vals['next_attempt_date'], vals['next_attempt_date'])
+            for message_id, error in entries:
+                self.browse(message_id).write(dict(vals, last_error=error))
+        if next_retry_date:
+            self.env.ref('ubik_app.ir_cron_send_fcm_outbox')._trigger(next_retry_date)
+
+        _logger.info("FCM outbox: %s sent, %s rejected, %s invalid tokens, %s to retry",
+                     len(sent_ids), len(failed), len(invalid), sum(len(entries) for entries in retry.values()))
+
+    @api.model
+    def _purge_old_messages(self):
+        limit_date = fields.Datetime.now() - timedelta(days=OUTBOX_KEEP_DAYS)
+        self.sudo().search([
+            ('state', 'in', ['sent', 'failed']),
+            ('write_date', '<', limit_date),
+        ]).unlink()
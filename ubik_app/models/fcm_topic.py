@@ -0,0 +1,94 @@
+from odoo import models, fields, api
+from odoo.tools import str2bool
+import logging
+import re
+
+from ..fcm_utils import update_fcm_topic
+
+_logger = logging.getLogger(__name__)
+
+# System parameter sending the product notifications to one FCM topic per division
+# instead of one message per device
+TOPIC_MODE_PARAM = 'ubik_app.fcm_topic_mode'
+
+
+class FcmTopicSubscription(models.Model):
+    _name = 'fcm.topic.subscription'
+    _description = 'Push Notification Topic Subscription'
+
+    # Subscriptions known to be applied in FCM, diffed against the wanted ones on sync
+    device_token = fields.Char(required=True, index=True)
+    topic = fields.Char(required=True, index=True)
+
+    _sql_constraints = [
+        ('device_token_topic_uniq', 'unique(device_token, topic)', 'A device is subscribed once to a topic.'),
+    ]
+
+    @api.model
+    def _is_topic_mode(self):
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param(TOPIC_MODE_PARAM, 'False'))
+
+    @api.model
+    def _category_topic(self, category_id):
+        """ Topic of a division; prefixed with the database so databases sharing the FCM project stay apart """
+        prefix = re.sub(r'[^a-zA-Z0-9_.~-]', '_', self.env.cr.dbname)
+        return f'{prefix}.division.{category_id}'
+
+    @api.model
+    def _get_wanted_subscriptions(self):
+        """ (device token, topic) pairs of the sales users and their employee's divisions """
+        users = self.env['res.users'].sudo().search([
+            ('groups_id', 'in', self.env.ref('ubik_app.group_sales_user').id),
+            ('device_token', '!=', False),
+        ])
+        return {
+            (user.device_token, self._category_topic(category_id))
+            for user in users
+            for category_id in user.employee_id.product_category_ids.ids
+        }
+
+    @api.model
+    def _cron_sync_topic_subscriptions(self):
+        """ Apply the difference between the wanted and the current subscriptions
+        with one batched IID call per topic and direction """
+        if not self._is_topic_mode():
+            return
+
+        wanted = self._get_wanted_subscriptions()
+        current = {
+            (sub['device_token'], sub['topic']): sub['id']
+            for sub in self.sudo().search_read([], ['device_token', 'topic'])
+        }
+
+        to_add = {}
+        for token, topic in wanted - current.keys():
+            to_add.setdefault(topic, []).append(token)
+        to_remove = {}
+        for token, topic in current.keys() - wanted:
+            to_remove.setdefault(topic, []).append(token)
+
+        new_vals = []
+        invalid_tokens = set()
+        for topic, tokens in to_add.items():
+            failed, rejected = update_fcm_topic(topic, tokens, subscribe=True)
+            skipped = set(failed) | set(rejected)
+            invalid_tokens.update(rejected)
+            new_vals += [{'device_token': token, 'topic': topic} for token in tokens if token not in skipped]
+        if new_vals:
+            self.sudo().create(new_vals)
+        if invalid_tokens:
+            # Same cleanup as the outbox: dead tokens are not subscribed again
+            self.env['res.users'].sudo().search([
+                ('device_token', 'in', list(invalid_tokens)),
+            ]).write({'device_token': False})
+
+        removed_ids = []
+        for topic, tokens in to_remove.items():
+            # Rejected tokens are no longer known to FCM, so they are not subscribed either
+            failed, _rejected = update_fcm_topic(topic, tokens, subscribe=False)
+            failed = set(failed)
+            removed_ids += [current[token, topic] for token in tokens if token not in failed]
+        if removed_ids:
+            self.sudo().browse(removed_ids).unlink()
+
+        _logger.info("FCM topics: %s subscriptions added, %s removed", len(new_vals), len(removed_ids))
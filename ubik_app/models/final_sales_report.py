@@ -1,4 +1,4 @@
-from odoo import models, fields, tools
+from odoo import models, fields
 
 # Helper model to make Remarks row editable leaving all other columns uneditable
 class MrDoctorFinalSalesRemarks(models.Model):
@@ -15,6 +15,7 @@ class MrDoctorFinalSalesRemarks(models.Model):
 
 class MrDoctorFinalSalesReport(models.Model):
     _name = 'mr.doctor.final.sales.report'
+    _inherit = 'ubik.sales.report.view'
     _description = 'Doctor Final Sales Report (FY Avg + Monthly)'
     _auto = False
 
@@ -77,37 +78,23 @@ class MrDoctorFinalSalesReport(models.Model):
             rec.remarks = remark.remarks if remark else False
 
     def init(self):
-        tools.drop_view_if_exists(self.env.cr, self._table)
-        self.env.cr.execute("""
+        self._create_report_view("""
 
-        CREATE OR REPLACE VIEW mr_doctor_final_sales_report AS (
-
-        WITH base AS (
+        WITH sales AS (
             SELECT
-                doc.territory_id,
-                doc.doctor_id,
+                line.id,
+                line.territory_id,
+                line.doctor_id,
 
                 -- SAFE amount
                 COALESCE(NULLIF(line.amount::text, 'NaN')::numeric, 0) AS amount,
 
-                -- PRECOMPUTE DATE ONCE
-                TO_DATE(line.month, 'YYYY-MM') AS sale_date
+                -- Period columns stored on the line
+                line.month_date AS sale_date,
+                line.fy_start AS fy_year
 
             FROM mr_doctor_line line
-            JOIN mr_doctor doc ON doc.id = line.mr_doctor_id
-        ),
-
-        sales AS (
-            SELECT
-                *,
-                EXTRACT(MONTH FROM sale_date) AS month_num,
-
-                CASE
-                    WHEN EXTRACT(MONTH FROM sale_date) >= 4
-                        THEN EXTRACT(YEAR FROM sale_date)
-                    ELSE EXTRACT(YEAR FROM sale_date) - 1
-                END AS fy_year
-            FROM base
+            WHERE line.mr_doctor_id IS NOT NULL
         ),
 
         fy_stats AS (
@@ -115,14 +102,15 @@ class MrDoctorFinalSalesReport(models.Model):
                 territory_id,
                 doctor_id,
                 fy_year,
-                COUNT(DISTINCT date_trunc('month', sale_date)) AS month_count,
+                COUNT(DISTINCT sale_date) AS month_count,
                 SUM(amount) AS fy_total
             FROM sales
             GROUP BY territory_id, doctor_id, fy_year
         )
 
         SELECT
-            row_number() OVER () AS id,
+            -- Stable id (lowest line id of the group) so rows keep their id across refreshes
+            MIN(s.id) AS id,
             s.territory_id,
             s.doctor_id,
             s.fy_year,
@@ -149,7 +137,7 @@ class MrDoctorFinalSalesReport(models.Model):
             -- Current month total (no repeated date_trunc)
             SUM(
                 CASE
-                    WHEN date_trunc('month', s.sale_date) = date_trunc('month', CURRENT_DATE)
+                    WHEN s.sale_date = date_trunc('month', CURRENT_DATE)::date
                     THEN s.amount ELSE 0
                 END
             ) AS curr_month_total,
@@ -185,7 +173,6 @@ class MrDoctorFinalSalesReport(models.Model):
             fs_prev.fy_total,
             fs_prev.month_count
 
-        )
         """)
 
 
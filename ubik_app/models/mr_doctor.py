@@ -1,11 +1,16 @@
-from odoo import fields, models, api, _
+from odoo import fields, models, api, tools, _
 from odoo.exceptions import UserError
 from datetime import datetime,timedelta
 from dateutil.relativedelta import relativedelta
-from markupsafe import Markup
+from markupsafe import Markup, escape
 import logging
 
 _logger = logging.getLogger(__name__)
+
+# Unique index on (mr_id, doctor_id, product_id, month) of mr_doctor_line
+DUPLICATE_LINE_INDEX = 'mr_doctor_line_mr_doctor_product_month_uniq'
+# cr.precommit.data key of the line changes waiting to be logged on their visit
+LINE_CHATTER_KEY = 'mr.doctor.line.chatter'
     
 class MrDoctor(models.Model):
     _name = 'mr.doctor'
@@ -16,15 +21,152 @@ class MrDoctor(models.Model):
     # Code to give sequence to MR Doctor visit record
     name = fields.Char(string="Reference",readonly=True,copy=False,default='New')
     
-    @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code('mr.doctor') or 'New'
-        return super(MrDoctor, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get('name', 'New') == 'New':
+                vals['name'] = self.env['ir.sequence'].next_by_code('mr.doctor') or 'New'
+        return super(MrDoctor, self).create(vals_list)
     
+    def init(self):
+        # Idempotency key of the visits submitted by the app: one visit per MR and key
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS mr_doctor_mr_id_client_ref_uniq
+                ON mr_doctor (mr_id, client_ref) WHERE client_ref IS NOT NULL
+        """)
+        # Keyset pagination of an MR's visits (see _get_visit_page)
+        tools.create_index(self.env.cr, 'mr_doctor_mr_id_create_date_id_index', self._table,
+                           ['mr_id', 'create_date DESC', 'id DESC'])
+        # Manager dashboard: counts and latest visits of the team per state
+        tools.create_index(self.env.cr, 'mr_doctor_mr_id_asm_state_create_date_index', self._table,
+                           ['mr_id', 'asm_state', 'create_date DESC', 'id DESC'])
+        # Records still waiting to be locked by _cron_auto_lock_past_month_records
+        tools.create_index(self.env.cr, 'mr_doctor_pending_lock_index', self._table, ['create_date'],
+                           where='record_save IS NOT TRUE AND unlock_for_edit IS NOT TRUE')
+
+    @api.model
+    def _get_visit_page(self, mr_id, limit=None, cursor=None, since=None, states=None):
+        """ Return (visits, next_cursor) for the visits of ``mr_id`` (an id or a
+        list of ids) ordered by (create_date, id) descending.
+
+        ``cursor`` is the next_cursor of the previous page and ``since``
+        keeps only visits whose header or lines were written after that datetime.
+        ``states`` restricts the visits to these asm_state values.
+        ``next_cursor`` is None on the last page.
+        """
+        self.env.flush_all()
+        mr_ids = list(mr_id) if isinstance(mr_id, (list, tuple, set)) else [mr_id]
+        query = ["SELECT d.id, d.create_date FROM mr_doctor d WHERE d.mr_id = ANY(%s)"]
+        params = [mr_ids]
+        if states:
+            query.append("AND d.asm_state = ANY(%s)")
+            params.append(list(states))
+        if cursor:
+            # The cursor carries the sort key itself: the page goes on even if
+            # its last visit has been deleted since
+            query.append("AND (d.create_date, d.id) < (%s, %s)")
+            params += self._parse_visit_cursor(cursor)
+        if since:
+            query.append("""
+                AND (
+                    d.write_date >= %s
+                    OR EXISTS (
+                        SELECT 1 FROM mr_doctor_line l
+                        WHERE l.mr_doctor_id = d.id AND l.write_date >= %s
+                    )
+                )""")
+            params += [since, since]
+        query.append("ORDER BY d.create_date DESC, d.id DESC")
+        if limit:
+            # One extra row tells whether another page exists
+            query.append("LIMIT %s")
+            params.append(limit + 1)
+
+        self.env.cr.execute("\n".join(query), params)
+        rows = self.env.cr.fetchall()
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last_id, last_create_date = rows[-1]
+            next_cursor = f"{last_create_date.isoformat()}_{last_id}"
+        return self.browse([row[0] for row in rows]), next_cursor
+
+    @api.model
+    def _parse_visit_cursor(self, cursor):
+        """ [create_date, id] of a next_cursor of _get_visit_page ("<iso datetime>_<id>"),
+        ValueError when it is not one """
+        create_date, _sep, visit_id = cursor.rpartition('_')
+        return [datetime.fromisoformat(create_date), int(visit_id)]
+
+    @api.model
+    def _get_dashboard_counts(self, mr_ids):
+        """ Visit counts of the MRs ``mr_ids`` by state, by MR and state and by
+        month and state, computed by the database """
+        domain = [('mr_id', 'in', list(mr_ids))]
+        by_state = {}
+        by_mr = {}
+        for mr, state, count in self.sudo()._read_group(domain, ['mr_id', 'asm_state'], ['__count']):
+            state = state or 'draft'
+            by_state[state] = by_state.get(state, 0) + count
+            counts = by_mr.setdefault(mr.id, {})
+            counts[state] = counts.get(state, 0) + count
+        by_month = {}
+        for month, state, count in self.sudo()._read_group(domain, ['create_date:month', 'asm_state'], ['__count']):
+            if month:
+                state = state or 'draft'
+                counts = by_month.setdefault(month.strftime('%Y-%m'), {})
+                counts[state] = counts.get(state, 0) + count
+        return {'by_state': by_state, 'by_mr': by_mr, 'by_month': by_month}
+
+    def _update_lines(self, line_vals_list):
+        """ Save the submitted lines of the visit: a line already holding the product
+        and month of a value gets that value, the other values reuse the remaining
+        lines in id order and the extra ones are created.
+
+        Writing by position would make reordered or swapped lines hold the key of
+        another line for a moment, which the duplicate line index rejects. """
+        self.ensure_one()
+        existing_lines = self.line_ids.sorted('id')
+        lines_by_key = {(line.product_id.id, line.month): line for line in existing_lines}
+        matched = {}
+        for index, vals in enumerate(line_vals_list):
+            line = lines_by_key.pop((vals['product_id'], vals['month']), None)
+            if line:
+                matched[index] = line
+
+        free_lines = iter(existing_lines - self.env['mr.doctor.line'].concat(*matched.values()))
+        to_create = []
+        for index, vals in enumerate(line_vals_list):
+            line = matched.get(index) or next(free_lines, None)
+            if line:
+                line.write(vals)
+            else:
+                to_create.append(vals)
+        return self.env['mr.doctor.line'].create(to_create)
+
+    def _log_notes(self, bodies, author_id=None, message_type='comment'):
+        """ Log internal notes, ``bodies`` being {visit id: body}, with one
+        mail.message create and without the follower / notification processing
+        of message_post """
+        if not bodies:
+            return self.env['mail.message']
+        subtype_id = self.env.ref('mail.mt_note').id
+        author_id = author_id or self.env.user.partner_id.id
+        return self.env['mail.message'].sudo().create([{
+            'body': body,
+            'message_type': message_type,
+            'subtype_id': subtype_id,
+            'author_id': author_id,
+            'model': self._name,
+            'res_id': res_id,
+        } for res_id, body in bodies.items()])
+
     mr_id = fields.Many2one('res.users', string="User")
     doctor_id = fields.Many2one('res.partner', string="Doctor",domain="[('is_doctor','=',True), ('territory_id','=', territory_id)]")
     doc_unique_id = fields.Char(string="Doctor ID", readonly=True)
+    client_ref = fields.Char(string="Client Reference", readonly=True, copy=False,
+                             help="Key generated by the mobile app so that a replayed submission does not create the visit twice")
     line_ids = fields.One2many('mr.doctor.line','mr_doctor_id', string="Sales Details")
 
     # New code to allow multi territories for MR and restrict doctor selection based on those territories. Territory assigned to MR is fetched from Employee module based on the logged in user.
@@ -35,12 +177,10 @@ class MrDoctor(models.Model):
     ################## New code for multi territories for MR starts here ##################
     @api.depends('mr_id')
     def _compute_allowed_territories(self):
+        Employee = self.env['hr.employee']
         for rec in self:
-            employee = self.env['hr.employee'].sudo().search(
-                [('user_id', '=', rec.mr_id.id)],
-                limit=1
-            )
-            rec.allowed_territory_ids = employee.territory_ids if employee else False
+            profile = Employee._get_employee_profile(rec.mr_id.id) if rec.mr_id else None
+            rec.allowed_territory_ids = self.env['territory.name'].browse(profile.territory_ids) if profile else False
     @api.onchange('mr_id')
     def _onchange_mr_id(self):
         return {
@@ -215,48 +355,46 @@ class MrDoctor(models.Model):
                 # Force recompute of record_save
             rec._compute_record_save()
 
-    def write(self, vals):
-        for rec in self:
-            # Detect REAL user edit only (very strict)
-            is_real_edit = (
-                rec.unlock_for_edit
-                and not self.env.user.has_group('base.group_system')
-                and not self.env.user.has_group('ubik_app.group_sales_manager')
-            )
-
-            # Fields that indicate SYSTEM operations (LOCK/UNLOCK)
-            system_fields = {
-                'unlock_for_edit',
-                'asm_state',
-                'original_asm_state',
-                'was_edited_after_unlock',
-                'unlocked_by',
-                'bulk_unlock_id',
-                'bulk_unlocked_by',
-                'bulk_unlock_date',
-            }
-
-            # Only mark edited if USER changes BUSINESS fields
-            if is_real_edit:
-                edited_fields = set(vals.keys()) - system_fields
+    # Fields that indicate SYSTEM operations (LOCK/UNLOCK)
+    _LOCK_SYSTEM_FIELDS = {
+        'unlock_for_edit',
+        'asm_state',
+        'original_asm_state',
+        'was_edited_after_unlock',
+        'unlocked_by',
+        'bulk_unlock_id',
+        'bulk_unlocked_by',
+        'bulk_unlock_date',
+    }
 
-                if edited_fields:
-                    vals['was_edited_after_unlock'] = True
-                    
-                    # If the record is being edited, ensure it's set to draft
-                    # This allows it to be submitted again
-                    if rec.asm_state in ['verified', 'rejected']:
-                        vals['asm_state'] = 'draft'
-
-            # Admin bypass
-            if self.env.user.has_group('base.group_system'):
-                continue
-
-            # Prevent editing locked records
-            if rec.record_save and not rec.unlock_for_edit:
-                raise UserError(_("Past month records are locked. Contact Admin."))
-
-        return super().write(vals)
+    def write(self, vals):
+        # The roles of the user are resolved once per call, not per record
+        user = self.env.user
+        # Admin bypass
+        if user.has_group('base.group_system'):
+            return super().write(vals)
+
+        # Prevent editing locked records
+        if self.filtered(lambda rec: rec.record_save and not rec.unlock_for_edit):
+            raise UserError(_("Past month records are locked. Contact Admin."))
+
+        # Detect REAL user edit only (very strict): only mark edited if USER changes BUSINESS fields
+        if user.has_group('ubik_app.group_sales_manager') or not set(vals) - self._LOCK_SYSTEM_FIELDS:
+            return super().write(vals)
+
+        real_edits = self.filtered('unlock_for_edit')
+        # If the record is being edited, ensure it's set to draft
+        # This allows it to be submitted again
+        to_reset = real_edits.filtered(lambda rec: rec.asm_state in ['verified', 'rejected'])
+        res = True
+        for records, extra_vals in (
+            (self - real_edits, {}),
+            (real_edits - to_reset, {'was_edited_after_unlock': True}),
+            (to_reset, {'was_edited_after_unlock': True, 'asm_state': 'draft'}),
+        ):
+            if records:
+                res = super(MrDoctor, records).write(dict(vals, **extra_vals)) and res
+        return res
 
     # Currently below code is in live where the records get locked as soon as the month changes
     # def _cron_auto_lock_past_month_records(self):
@@ -285,20 +423,30 @@ class MrDoctor(models.Model):
     def _cron_auto_lock_past_month_records(self):
         today = datetime.today()
 
-        records = self.search([
-            ('unlock_for_edit', '=', False)
-        ])
-
-        for rec in records:
-            if not rec.create_date:
-                continue
-
-            # Get 11th of NEXT month of record creation
-            lock_date = (rec.create_date + relativedelta(months=1)).replace(day=11)
-
-            # If today is on or after lock date → lock it
-            if today >= lock_date:
-                rec.record_save = True
+        # A record is locked from the 11th of the month following its creation,
+        # so everything created before this date has reached its lock date
+        cutoff = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if today.day < 11:
+            cutoff -= relativedelta(months=1)
+
+        # Single set-based UPDATE touching only the records newly crossing their lock date
+        # (served by the partial index created in init)
+        self.env.flush_all()
+        self.env.cr.execute("""
+            UPDATE mr_doctor
+               SET record_save = TRUE,
+                   write_uid = %s,
+                   write_date = (now() AT TIME ZONE 'UTC')
+             WHERE record_save IS NOT TRUE
+               AND unlock_for_edit IS NOT TRUE
+               AND create_date < %s
+         RETURNING id
+        """, [self.env.uid, cutoff])
+        locked_count = len(self.env.cr.fetchall())
+        self.invalidate_model(['record_save', 'write_uid', 'write_date'])
+
+        _logger.info("Auto-locked %s MR doctor records created before %s", locked_count, cutoff.date())
+        return locked_count
     
     class MrDoctorRejectWizard(models.TransientModel):
         _name = 'mr.doctor.reject.wizard'
@@ -337,6 +485,65 @@ class MrDoctorLine(models.Model):
 
     mr_doctor_id = fields.Many2one('mr.doctor',string="MR Doctor")
 
+    # Header and period columns stored on the line so the sales reports can filter and group
+    # on indexed columns instead of joining mr_doctor and parsing the month string
+    mr_id = fields.Many2one(related='mr_doctor_id.mr_id', store=True, index=True, string="MR")
+    territory_id = fields.Many2one(related='mr_doctor_id.territory_id', store=True, index=True, string="Territory")
+    doctor_id = fields.Many2one(related='mr_doctor_id.doctor_id', store=True, index=True, string="Doctor")
+    month_date = fields.Date(string="Month Date", compute='_compute_month_period', store=True, index=True)
+    month_num = fields.Integer(string="Month Number", compute='_compute_month_period', store=True)
+    fy_start = fields.Integer(string="Fiscal Year Start", compute='_compute_month_period', store=True, index=True)
+
+    @api.depends('month')
+    def _compute_month_period(self):
+        """ Fiscal year runs from April to March; fy_start is the calendar year it begins in """
+        for line in self:
+            if not line.month:
+                line.month_date = False
+                line.month_num = 0
+                line.fy_start = 0
+                continue
+            month_date = datetime.strptime(line.month, '%Y-%m').date()
+            line.month_date = month_date
+            line.month_num = month_date.month
+            line.fy_start = month_date.year if month_date.month >= 4 else month_date.year - 1
+
+    def init(self):
+        # Covering indexes for the report views' territory / doctor / MR filters per fiscal year
+        for column in ('territory_id', 'doctor_id', 'mr_id'):
+            tools.create_index(self.env.cr, f'mr_doctor_line_{column}_fy_start_index', self._table,
+                               [column, 'fy_start', 'month_num'])
+        # mr_id / doctor_id are filled by the ORM after init() when the columns are new
+        self.pool.post_init(self._create_duplicate_line_index)
+
+    def _create_duplicate_line_index(self):
+        """ One line per MR, doctor, product and month, enforced by the database so
+        that concurrent submissions cannot both pass the duplicate check """
+        cr = self.env.cr
+        self.env.flush_all()
+        cr.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [DUPLICATE_LINE_INDEX])
+        if cr.fetchone():
+            return
+        cr.execute("""
+            SELECT 1
+              FROM mr_doctor_line
+             WHERE mr_id IS NOT NULL AND doctor_id IS NOT NULL
+               AND product_id IS NOT NULL AND month IS NOT NULL
+             GROUP BY mr_id, doctor_id, product_id, month
+            HAVING COUNT(*) > 1
+             LIMIT 1
+        """)
+        if cr.fetchone():
+            _logger.warning("Duplicate MR doctor lines exist, unique index %s not created; "
+                            "remove the duplicates and update the module", DUPLICATE_LINE_INDEX)
+            return
+        cr.execute(f"""
+            CREATE UNIQUE INDEX {DUPLICATE_LINE_INDEX}
+                ON mr_doctor_line (mr_id, doctor_id, product_id, month)
+             WHERE mr_id IS NOT NULL AND doctor_id IS NOT NULL
+               AND product_id IS NOT NULL AND month IS NOT NULL
+        """)
+
     allowed_category_ids = fields.Many2many('product.category',compute='_compute_allowed_categories',store=False)
 
     category_id = fields.Many2one('product.category',string="Division",domain="[('id', 'in', allowed_category_ids)]")
@@ -349,35 +556,76 @@ class MrDoctorLine(models.Model):
         store=False
     )
 
+    @api.model
+    def _get_existing_line_keys(self, mr_id, keys, exclude_visit_id=None):
+        """ Return the (doctor_id, product_id, month) ``keys`` already recorded by
+        MR ``mr_id`` (outside visit ``exclude_visit_id``), checked with one query on
+        the denormalised line columns """
+        keys = set(keys)
+        if not keys:
+            return set()
+        domain = [
+            ('mr_id', '=', mr_id),
+            ('doctor_id', 'in', list({key[0] for key in keys})),
+            ('product_id', 'in', list({key[1] for key in keys})),
+            ('month', 'in', list({key[2] for key in keys})),
+        ]
+        if exclude_visit_id:
+            domain.append(('mr_doctor_id', '!=', exclude_visit_id))
+        rows = self.sudo().search_read(domain, ['doctor_id', 'product_id', 'month'], load=None)
+        return {(row['doctor_id'], row['product_id'], row['month']) for row in rows} & keys
+
+    @api.model
+    def _is_duplicate_line_error(self, error):
+        """ Whether an IntegrityError was raised by the duplicate line index """
+        return getattr(getattr(error, 'diag', None), 'constraint_name', None) == DUPLICATE_LINE_INDEX
+
+    def _queue_chatter(self, entries):
+        """ Queue (visit id, body) chatter entries of line changes. They are logged
+        when the transaction is flushed, as one note per visit and author, so a
+        visit saved with 30 lines gets one message instead of 30. A rolled back
+        savepoint drops the entries queued inside it with the other precommit data. """
+        entries = [(visit_id, body) for visit_id, body in entries if visit_id]
+        if not entries:
+            return
+        data = self.env.cr.precommit.data
+        pending = data.get(LINE_CHATTER_KEY)
+        if pending is None:
+            pending = data[LINE_CHATTER_KEY] = {}
+            self.env.cr.precommit.add(self._flush_chatter)
+        author_id = self.env.user.partner_id.id
+        for visit_id, body in entries:
+            pending.setdefault((author_id, visit_id), []).append(body)
+
+    def _flush_chatter(self):
+        pending = self.env.cr.precommit.data.pop(LINE_CHATTER_KEY, {})
+        visits = self.env['mr.doctor'].sudo().browse({visit_id for _author_id, visit_id in pending})
+        existing_ids = set(visits.exists().ids)
+        by_author = {}
+        for (author_id, visit_id), bodies in pending.items():
+            if visit_id in existing_ids:
+                by_author.setdefault(author_id, {})[visit_id] = Markup("<br/><br/>").join(bodies)
+        for author_id, bodies in by_author.items():
+            self.env['mr.doctor'].sudo()._log_notes(bodies, author_id=author_id)
+        # Precommit hooks run after the flush of the transaction
+        self.env['mail.message'].flush_model()
+
     # Code to post message in chatter when a line is added with details of the added line (product, quantity, unit price)
-    def create(self, vals):
-        record = super().create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
 
-        if record.mr_doctor_id:
-            message = Markup(
+        self._queue_chatter([(
+            record.mr_doctor_id.id,
+            Markup(
                 "New Line Added:<br/>"
                 f"Product: {record.product_id.display_name if record.product_id else ''}<br/>"
                 f"Quantity: {record.product_qty}<br/>"
                 f"Unit Price: {record.price_unit}"
-            )
-
-            # Create message without automatic follower subscription
-            msg_values = {
-                'body': message,
-                'message_type': 'comment',
-                'subtype_id': self.env.ref('mail.mt_note').id,
-                'author_id': self.env.user.partner_id.id,
-                'model': 'mr.doctor',
-                'res_id': record.mr_doctor_id.id,
-            }
-            
-            try:
-                self.env['mail.message'].sudo().create(msg_values)
-            except:
-                # If that fails, try without sudo
-                self.env['mail.message'].create(msg_values)
+            ),
+        ) for record in records])
 
-        return record
+        return records
 
     # Code to post message in chatter when a line is updated with details of the updated fields (product, quantity, unit price)
     def write(self, vals):
@@ -401,6 +649,7 @@ class MrDoctorLine(models.Model):
 
         res = super().write(vals)
 
+        entries = []
         for line in self:
             changes = []
             old_values = old_values_map.get(line.id, {})
@@ -420,34 +669,25 @@ class MrDoctorLine(models.Model):
                         label = field_labels.get(field, field)
                         changes.append(f"{label}: {old} → {new}")
 
-            if changes and line.mr_doctor_id:
-                message = Markup(
-                    "Line Updated:<br/>" + "<br/>".join(changes)
-                )
-
-                line.mr_doctor_id.message_post(
-                    body=message,
-                    message_type="comment",
-                    subtype_xmlid="mail.mt_note",
-                )
+            if changes:
+                entries.append((
+                    line.mr_doctor_id.id,
+                    Markup("Line Updated:<br/>" + "<br/>".join(changes)),
+                ))
+        self._queue_chatter(entries)
 
         return res
     
     # Code to post message in chatter when a line is deleted with details of the deleted line (product, quantity, unit price)
     def unlink(self):
-        for line in self:
-            if line.mr_doctor_id:
-                message = Markup(
-                    "Line Removed:<br/>"
-                    f"Product: {line.product_id.display_name if line.product_id else ''}<br/>"
-                    f"Quantity: {line.product_qty}"
-                )
-
-                line.mr_doctor_id.message_post(
-                    body=message,
-                    message_type="comment",
-                    subtype_xmlid="mail.mt_note",
-                )
+        self._queue_chatter([(
+            line.mr_doctor_id.id,
+            Markup(
+                "Line Removed:<br/>"
+                f"Product: {line.product_id.display_name if line.product_id else ''}<br/>"
+                f"Quantity: {line.product_qty}"
+            ),
+        ) for line in self])
 
         return super().unlink()
     
@@ -459,44 +699,28 @@ class MrDoctorLine(models.Model):
             if not line.mr_doctor_id or not line.mr_doctor_id.mr_id:
                 continue
 
-            employee = self.env['hr.employee'].sudo().search(
-                [('user_id', '=', line.mr_doctor_id.mr_id.id)],
-                limit=1
-            )
-
-            if employee and employee.product_category_ids:
-                line.allowed_category_ids = employee.product_category_ids
+            profile = self.env['hr.employee']._get_employee_profile(line.mr_doctor_id.mr_id.id)
+            if profile and profile.category_ids:
+                line.allowed_category_ids = self.env['product.category'].browse(profile.category_ids)
     
     @api.depends('category_id', 'mr_doctor_id.territory_id')
     def _compute_allowed_products(self):
+        Product = self.env['product.template']
+        # Lines of the same division and territory share one search
+        products_by_key = {}
         for line in self:
-            line.allowed_product_ids = False
-            
-            if not line.category_id or not line.mr_doctor_id or not line.mr_doctor_id.territory_id:
+            territory = line.mr_doctor_id.territory_id
+            if not line.category_id or not territory:
+                line.allowed_product_ids = False
                 continue
-            
-            # Base domain: sale_ok=True and selected category
-            domain = [
-                ('sale_ok', '=', True),
-                ('categ_id', '=', line.category_id.id)
-            ]
-            
-            # Get all products matching base criteria
-            products = self.env['product.template'].search(domain)
-            
-            # Filter products based on territory
-            allowed_products = self.env['product.template']
-            
-            for product in products:
-                # If product is territory specific, check if current territory is allowed
-                if product.is_territory_specific_product:
-                    if line.mr_doctor_id.territory_id in product.allowed_territory_ids:
-                        allowed_products |= product
-                else:
-                    # If product is not territory specific, include it
-                    allowed_products |= product
-            
-            line.allowed_product_ids = allowed_products
+
+            key = (line.category_id.id, territory.id)
+            if key not in products_by_key:
+                products_by_key[key] = Product.search([
+                    ('sale_ok', '=', True),
+                    ('categ_id', '=', line.category_id.id),
+                ] + Product._get_territory_visibility_domain([territory.id]))
+            line.allowed_product_ids = products_by_key[key]
 
     # Code to clear the product lines if the Division is changed
     @api.onchange('category_id')
@@ -610,7 +834,8 @@ class ProductTemplate(models.Model):
 
     is_territory_specific_product = fields.Boolean(
         string="Territory Specific Product",
-        help="If enabled, product will be visible only to selected territories."
+        help="If enabled, product will be visible only to selected territories.",
+        index=True,
     )
 
     allowed_territory_ids = fields.Many2many(
@@ -618,6 +843,23 @@ class ProductTemplate(models.Model):
         string="Allowed Territories"
     )
 
+    def init(self):
+        super().init()
+        # Catalog lookups by division only ever read active products
+        tools.create_index(self.env.cr, 'product_template_categ_id_active_index', self._table,
+                           ['categ_id'], where='active IS TRUE')
+
+    @api.model
+    def _get_territory_visibility_domain(self, territory_ids):
+        """ Domain of the products visible in at least one of ``territory_ids``, so a
+        single search resolves the visibility (the allowed territories are matched
+        through the indexed relation table) """
+        return [
+            '|',
+            ('is_territory_specific_product', '=', False),
+            ('allowed_territory_ids', 'in', list(territory_ids)),
+        ]
+
 class MrDoctorBulkLockWizard(models.TransientModel):
     _name = 'mr.doctor.bulk.lock.wizard'
     _description = 'MR Doctor Bulk Lock/Unlock Wizard'
@@ -680,13 +922,10 @@ class MrDoctorBulkLockWizard(models.TransientModel):
             if not wizard.user_id:
                 continue
             
-            # Find employee linked to this user
-            employee = self.env['hr.employee'].sudo().search([
-                ('user_id', '=', wizard.user_id.id)
-            ], limit=1)
-            
-            if employee and employee.product_category_ids:
-                wizard.allowed_category_ids = employee.product_category_ids
+            # Divisions of the employee linked to this user
+            profile = self.env['hr.employee']._get_employee_profile(wizard.user_id.id)
+            if profile and profile.category_ids:
+                wizard.allowed_category_ids = self.env['product.category'].browse(profile.category_ids)
     
     @api.onchange('user_id')
     def _onchange_user_id(self):
@@ -724,27 +963,8 @@ class MrDoctorBulkLockWizard(models.TransientModel):
                 wizard.record_count = 0
                 continue
                 
-            domain = wizard._get_record_domain()
-             # If category is specified, we need to check line records
-            if wizard.category_id:
-                # Find mr.doctor records that have at least one line with this category
-                line_domain = [
-                    ('mr_doctor_id.mr_id', '=', wizard.user_id.id),
-                    ('mr_doctor_id.create_date', '>=', wizard._get_month_start(wizard.month)),
-                    ('mr_doctor_id.create_date', '<=', wizard._get_month_end(wizard.month)),
-                    ('category_id', '=', wizard.category_id.id)
-                ]
-                
-                if wizard.doctor_id:
-                    line_domain.append(('mr_doctor_id.doctor_id', '=', wizard.doctor_id.id))
-                
-                # Get distinct mr_doctor_ids from lines
-                lines = self.env['mr.doctor.line'].sudo().search(line_domain)
-                mr_doctor_ids = lines.mapped('mr_doctor_id').ids
-                wizard.record_count = len(mr_doctor_ids)
-            else:
-                # Original count logic without category filter
-                wizard.record_count = self.env['mr.doctor'].sudo().search_count(domain)
+            # The domain includes the division filter when one is set
+            wizard.record_count = self.env['mr.doctor'].sudo().search_count(wizard._get_record_domain())
     
     def _get_record_domain(self):
         """Build domain for finding records to process"""
@@ -756,6 +976,10 @@ class MrDoctorBulkLockWizard(models.TransientModel):
         
         if self.doctor_id:
             domain.append(('doctor_id', '=', self.doctor_id.id))
+
+        if self.category_id:
+            # Records with at least one line of this division, as a subquery
+            domain.append(('line_ids.category_id', '=', self.category_id.id))
             
         return domain
     
@@ -775,24 +999,7 @@ class MrDoctorBulkLockWizard(models.TransientModel):
     
     def _get_filtered_records(self):
         """Get records filtered by all criteria including category if specified"""
-        if not self.category_id:
-            # No category filter, return all records matching base domain
-            domain = self._get_record_domain()
-            return self.env['mr.doctor'].sudo().search(domain)
-        
-        # Category filter applied - find mr.doctor records that have at least one line with this category
-        line_domain = [
-            ('mr_doctor_id.mr_id', '=', self.user_id.id),
-            ('mr_doctor_id.create_date', '>=', self._get_month_start(self.month)),
-            ('mr_doctor_id.create_date', '<=', self._get_month_end(self.month)),
-            ('category_id', '=', self.category_id.id)
-        ]
-        
-        if self.doctor_id:
-            line_domain.append(('mr_doctor_id.doctor_id', '=', self.doctor_id.id))
-        
-        lines = self.env['mr.doctor.line'].sudo().search(line_domain)
-        return lines.mapped('mr_doctor_id')
+        return self.env['mr.doctor'].sudo().search(self._get_record_domain())
     
     def action_process_bulk_lock(self):
         """Process bulk lock/unlock operation"""
@@ -815,34 +1022,36 @@ class MrDoctorBulkLockWizard(models.TransientModel):
         
         # ===================== UNLOCK =====================
         if self.operation_type == 'unlock':
-            
+            now = fields.Datetime.now()
+            category_info = f" (Division: {self.category_id.name})" if self.category_id else ""
+            bodies = {}
+
+            # One write per original state instead of one per record
+            records_by_state = {}
             for record in records:
-                original_state = record.asm_state
+                records_by_state.setdefault(record.asm_state, []).append(record.id)
+
+                doctor_info = f"for Dr. {record.doctor_id.name}" if record.doctor_id else ""
+                bodies[record.id] = escape(_("Record bulk unlocked by Admin %s  %s%s. Original state: %s") % (
+                    self.env.user.name,
+                    doctor_info,
+                    category_info,
+                    record.asm_state
+                ))
 
-                record.write({
+            for original_state, record_ids in records_by_state.items():
+                records.browse(record_ids).write({
                     'original_asm_state': original_state,
                     'unlock_for_edit': True,
                     'unlocked_by': self.env.user.id,
                     'asm_state': 'draft',
                     'bulk_unlock_id': bulk_ref,
                     'bulk_unlocked_by': self.env.user.id,
-                    'bulk_unlock_date': fields.Datetime.now(),
+                    'bulk_unlock_date': now,
                     'was_edited_after_unlock': False,
                 })
 
-            for record in records:
-                doctor_info = f"for Dr. {record.doctor_id.name}" if record.doctor_id else ""
-                category_info = f" (Division: {self.category_id.name})" if self.category_id else ""
-
-                record.message_post(
-                    body=_("Record bulk unlocked by Admin %s  %s%s. Original state: %s") % (
-                        self.env.user.name,
-                        
-                        doctor_info,
-                        category_info,
-                        record.original_asm_state
-                    )
-                )
+            records._log_notes(bodies, message_type='notification')
 
             category_text = f" in division {self.category_id.name}" if self.category_id else ""
 
@@ -877,6 +1086,9 @@ class MrDoctorBulkLockWizard(models.TransientModel):
 
             edited_count = 0
             restored_count = 0
+            category_info = f" (Division: {self.category_id.name})" if self.category_id else ""
+            records_by_state = {}
+            bodies = {}
 
             for record in records:
 
@@ -885,7 +1097,7 @@ class MrDoctorBulkLockWizard(models.TransientModel):
                 original_state = record.original_asm_state
                 current_state = record.asm_state
 
-                _logger.info(
+                _logger.debug(
                     "Processing record %s: edited=%s original=%s current=%s",
                     record.id, was_edited, original_state, current_state
                 )
@@ -896,8 +1108,8 @@ class MrDoctorBulkLockWizard(models.TransientModel):
                     # Check if the current state is different from original
                     if current_state != original_state:
                         was_edited = True
-                        _logger.info("Record %s marked as edited because it reached %s state", 
-                                    record.id, current_state)
+                        _logger.debug("Record %s marked as edited because it reached %s state",
+                                      record.id, current_state)
 
                 # DECIDE STATE BASED ON THE FIXED was_edited FLAG
                 if not was_edited:
@@ -912,31 +1124,35 @@ class MrDoctorBulkLockWizard(models.TransientModel):
                         new_state = 'submitted'
                     edited_count += 1
 
-                # APPLY WRITE
-                record.write({
-                    'unlock_for_edit': False,
-                    'asm_state': new_state,
-                    'original_asm_state': False,
-                })
+                records_by_state.setdefault(new_state, []).append(record.id)
 
                 # MESSAGE
                 doctor_info = f"for Dr. {record.doctor_id.name}" if record.doctor_id else ""
-                category_info = f" (Division: {self.category_id.name})" if self.category_id else ""
 
                 if was_edited:
                     msg = f"Edited - {'kept verified state' if new_state == 'verified' else 'sent for re-verification'}"
                 else:
                     msg = f"Restored to original state: {original_state}"
 
-                record.message_post(
-                    body=_("Record bulk locked by Admin %s  %s%s. %s") % (
-                        self.env.user.name,
-                    
-                        doctor_info,
-                        category_info,
-                        msg
-                    )
-                )
+                bodies[record.id] = escape(_("Record bulk locked by Admin %s  %s%s. %s") % (
+                    self.env.user.name,
+                    doctor_info,
+                    category_info,
+                    msg
+                ))
+
+            # APPLY WRITE: one per target state
+            for new_state, record_ids in records_by_state.items():
+                records.browse(record_ids).write({
+                    'unlock_for_edit': False,
+                    'asm_state': new_state,
+                    'original_asm_state': False,
+                })
+
+            records._log_notes(bodies, message_type='notification')
+
+            _logger.info("Bulk lock %s: %s records (%s edited, %s restored)",
+                         bulk_ref, len(records), edited_count, restored_count)
 
             # FINAL MESSAGE
             category_text = f" in division {self.category_id.name}" if self.category_id else ""
@@ -1,59 +1,119 @@
 from odoo import models, api, _
-from ..fcm_utils import send_fcm_notification
+from collections import defaultdict
+
+# Product lines listed in a digest notification before "and N more"
+DIGEST_MAX_LINES = 5
 
 class ProductTemplate(models.Model):
     _inherit = 'product.template'
 
-    @api.model
-    def create(self, vals):
-        product = super().create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        products = super().create(vals_list)
 
         title = "New Product Launched"
-        body = f"{product.name} is now available."
-
-        product._notify_sales_users(title, body)
+        products._notify_product_events([
+            (product, title, f"{product.name} is now available.")
+            for product in products
+        ])
 
-        return product
+        return products
 
     def write(self, vals):
-        for product in self:
-
-            price_changed = False
-            discontinued = False
-            old_price = product.list_price
-
-            if 'list_price' in vals and vals['list_price'] != old_price:
-                price_changed = True
-
-            if 'active' in vals and vals['active'] is False:
-                discontinued = True
-
-            result = super(ProductTemplate, product).write(vals)
-
-            # Send after write
-            if price_changed:
-                title = "Product Price Updated"
-                body = f"{product.name} price changed from {old_price} to {product.list_price}"
-                product._notify_sales_users(title, body)
-
-            if discontinued:
-                title = "Product Discontinued"
-                body = f"{product.name} is no longer available."
-                product._notify_sales_users(title, body)
+        # Snapshot the watched values in one read, then diff them after a single write
+        watched = [field for field in ('list_price', 'active') if field in vals]
+        old_values = {}
+        if watched:
+            old_values = {
+                row['id']: row
+                for row in self.read(watched)
+            }
+
+        result = super().write(vals)
+
+        # Send after write
+        events = []
+        if 'list_price' in vals:
+            for product in self:
+                old_price = old_values[product.id]['list_price']
+                if old_price != product.list_price:
+                    title = "Product Price Updated"
+                    body = f"{product.name} price changed from {old_price} to {product.list_price}"
+                    events.append((product, title, body))
+
+        if 'active' in vals and not vals['active']:
+            for product in self:
+                if old_values[product.id]['active']:
+                    title = "Product Discontinued"
+                    body = f"{product.name} is no longer available."
+                    events.append((product, title, body))
+
+        if events:
+            self._notify_product_events(events)
 
         return result
 
     def _notify_sales_users(self, title, body):
-        for product in self:
+        self._notify_product_events([(product, title, body) for product in self])
 
-            users = self.env['res.users'].search([
-                ('groups_id', 'in', self.env.ref('ubik_app.group_sales_user').id),
-                ('employee_id.product_category_ids', 'in', product.categ_id.id),
-                ('device_token', '!=', False)
-            ])
-
-            # Collect unique device tokens
-            tokens = set(users.mapped('device_token'))
+    @api.model
+    def _notify_product_events(self, events):
+        """ Notify the sales users of the divisions of the products in ``events``,
+        a list of (product, title, body).
+
+        Every device gets a single notification, a digest when several events
+        concern its divisions, so the number of messages depends on the audiences
+        and not on the number of products. In topic mode one message is sent per
+        division topic instead of one per device.
+        """
+        events_by_category = defaultdict(list)
+        for product, title, body in events:
+            if product.categ_id:
+                events_by_category[product.categ_id.id].append((title, body))
+        if not events_by_category:
+            return
+
+        Outbox = self.env['fcm.notification.outbox']
+        Topic = self.env['fcm.topic.subscription']
+        if Topic._is_topic_mode():
+            for category_id, category_events in events_by_category.items():
+                title, body = self._get_notification_digest(category_events)
+                Outbox._enqueue_topic(Topic._category_topic(category_id), title, body)
+            return
+
+        # One search for the users of all the divisions
+        users = self.env['res.users'].sudo().search([
+            ('groups_id', 'in', self.env.ref('ubik_app.group_sales_user').id),
+            ('employee_id.product_category_ids', 'in', list(events_by_category)),
+            ('device_token', '!=', False)
+        ])
+
+        # Devices following the same divisions form one audience and share one digest
+        categories_by_token = defaultdict(set)
+        for user in users:
+            categories_by_token[user.device_token].update(
+                set(user.employee_id.product_category_ids.ids) & events_by_category.keys()
+            )
+        tokens_by_audience = defaultdict(list)
+        for token, category_ids in categories_by_token.items():
+            tokens_by_audience[frozenset(category_ids)].append(token)
+
+        for category_ids, tokens in tokens_by_audience.items():
+            audience_events = [
+                event
+                for category_id in sorted(category_ids)
+                for event in events_by_category[category_id]
+            ]
+            title, body = self._get_notification_digest(audience_events)
+            # Delivered by the outbox cron once the transaction commits
+            Outbox._enqueue(tokens, title, body)
 
-            for token in tokens:
-                send_fcm_notification(token, title, body)
\ No newline at end of file
+    @api.model
+    def _get_notification_digest(self, events):
+        """ (title, body) of one notification summing up ``events`` """
+        if len(events) == 1:
+            return events[0]
+        lines = [body for _title, body in events[:DIGEST_MAX_LINES]]
+        if len(events) > DIGEST_MAX_LINES:
+            lines.append(f"and {len(events) - DIGEST_MAX_LINES} more updates.")
+        return f"{len(events)} Product Updates", "\n".join(lines)
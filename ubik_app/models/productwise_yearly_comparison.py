@@ -54,14 +54,14 @@ class MrProductFyComparison(models.Model):
 
                 sales AS (
                     SELECT
-                        doc.territory_id,
+                        line.territory_id,
                         line.category_id,
                         line.product_id,
-                        to_date(line.month, 'YYYY-MM') AS sale_date,
+                        line.month_date AS sale_date,
                         line.product_qty,
                         line.amount
                     FROM mr_doctor_line line
-                    JOIN mr_doctor doc ON doc.id = line.mr_doctor_id
+                    WHERE line.mr_doctor_id IS NOT NULL
                 )
 
                 SELECT
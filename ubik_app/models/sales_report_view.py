@@ -0,0 +1,101 @@
+from odoo import models, api, tools
+from odoo.tools import str2bool
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# System parameter switching the doctor-wise sales reports to materialized views
+MATERIALIZED_PARAM = 'ubik_app.materialized_sales_reports'
+# Last data signature the materialized reports were refreshed for
+SIGNATURE_PARAM = 'ubik_app.sales_reports_signature'
+
+# Reports backed by _create_report_view, refreshed by _cron_refresh_sales_reports
+SALES_REPORT_MODELS = [
+    'mr.doctor.sales.report',
+    'doctor.division.sales.report',
+    'mr.doctor.avg.sales.report',
+    'mr.doctor.final.sales.report',
+]
+
+
+class SalesReportView(models.AbstractModel):
+    _name = 'ubik.sales.report.view'
+    _description = 'Sales Report View (plain or materialized)'
+
+    # Columns identifying a report row; the unique index on them allows REFRESH ... CONCURRENTLY
+    _report_unique_columns = ['id']
+
+    @api.model
+    def _is_materialized_mode(self):
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param(MATERIALIZED_PARAM, 'False'))
+
+    def _get_relation_kind(self):
+        """ 'v' for a view, 'm' for a materialized view, None when missing """
+        self.env.cr.execute("SELECT relkind FROM pg_class WHERE relname = %s", [self._table])
+        row = self.env.cr.fetchone()
+        return row[0] if row else None
+
+    def _drop_report_view(self):
+        if self._get_relation_kind() == 'm':
+            self.env.cr.execute(f"DROP MATERIALIZED VIEW {self._table} CASCADE")
+        else:
+            tools.drop_view_if_exists(self.env.cr, self._table)
+
+    def _create_report_view(self, query):
+        """ (Re)create the report as a plain view, or as a materialized view with
+        its unique index when the materialized mode is enabled """
+        self._drop_report_view()
+        if self._is_materialized_mode():
+            _logger.info("CREATING MATERIALIZED VIEW %s", self._table)
+            self.env.cr.execute(f"CREATE MATERIALIZED VIEW {self._table} AS ({query})")
+            self.env.cr.execute(
+                f"CREATE UNIQUE INDEX {self._table}_unique_index "
+                f"ON {self._table} ({', '.join(self._report_unique_columns)})"
+            )
+        else:
+            self.env.cr.execute(f"CREATE OR REPLACE VIEW {self._table} AS ({query})")
+
+    def _refresh_report_view(self):
+        """ Refresh the materialized view without blocking readers; no-op for plain views """
+        if self._get_relation_kind() != 'm':
+            return
+        self.env.flush_all()
+        self.env.cr.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {self._table}")
+        self.env.invalidate_all()
+
+    @api.model
+    def _get_sales_data_signature(self):
+        """ Cheap fingerprint of the data the reports aggregate. Deleted lines change the
+        count, edited ones the max write_date; the date is part of it because the
+        current FY / current month columns depend on it. """
+        self.env.cr.execute("""
+            SELECT
+                (SELECT COUNT(*) || '/' || COALESCE(MAX(write_date)::text, '') FROM mr_doctor_line),
+                (SELECT COALESCE(MAX(write_date)::text, '') FROM mr_doctor),
+                CURRENT_DATE::text
+        """)
+        return '|'.join(self.env.cr.fetchone())
+
+    @api.model
+    def _cron_refresh_sales_reports(self):
+        """ Keep the report relations in line with the materialized mode parameter and
+        refresh the materialized ones when the visit data changed since the last run """
+        materialized = self._is_materialized_mode()
+        for model_name in SALES_REPORT_MODELS:
+            report = self.env[model_name]
+            if (report._get_relation_kind() == 'm') != materialized:
+                # The mode was switched: rebuild the relation
+                report.init()
+
+        if not materialized:
+            return
+
+        ICP = self.env['ir.config_parameter'].sudo()
+        signature = self._get_sales_data_signature()
+        if ICP.get_param(SIGNATURE_PARAM) == signature:
+            return
+
+        for model_name in SALES_REPORT_MODELS:
+            self.env[model_name]._refresh_report_view()
+        ICP.set_param(SIGNATURE_PARAM, signature)
+        _logger.info("Refreshed materialized sales reports")
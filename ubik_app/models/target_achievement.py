@@ -4,6 +4,22 @@ import logging
 
 _logger = logging.getLogger(__name__)
 
+# Editable monthly target fields of the quarterly report ({mm}_tgt), in fiscal year order
+MONTH_LABELS = {
+    '04': 'Apr Tgt',
+    '05': 'May Tgt',
+    '06': 'Jun Tgt',
+    '07': 'Jul Tgt',
+    '08': 'Aug Tgt',
+    '09': 'Sep Tgt',
+    '10': 'Oct Tgt',
+    '11': 'Nov Tgt',
+    '12': 'Dec Tgt',
+    '01': 'Jan Tgt',
+    '02': 'Feb Tgt',
+    '03': 'Mar Tgt',
+}
+
 # ------------------------------------------------------------------
 # Territory Monthly Target (UNCHANGED – REQUIRED)
 # ------------------------------------------------------------------
@@ -11,8 +27,8 @@ class MrTerritoryTarget(models.Model):
     _name = 'mr.territory.target'
     _description = 'Territory Monthly Target'
 
-    territory_id = fields.Many2one('territory.name', required=True)
-    fiscal_year = fields.Char(required=True)  # e.g. 2025-26
+    territory_id = fields.Many2one('territory.name', required=True, index=True)
+    fiscal_year = fields.Char(required=True, index=True)  # e.g. 2025-26
     month = fields.Selection([
         ('04', 'April'), ('05', 'May'), ('06', 'June'),
         ('07', 'July'), ('08', 'August'), ('09', 'September'),
@@ -68,121 +84,132 @@ class MrTargetAchievementQuarterlyReport(models.Model):
     # ================= YEARLY TARGET (EDITABLE) =================
     yearly_target = fields.Float(string="Yearly Target",compute="_compute_yearly_target",inverse="_inverse_yearly_target",readonly=False)
 
-    def _compute_yearly_target(self):
-        Target = self.env['mr.target.achievement.yearly.target']
+    def _yearly_target_map(self):
+        """ Yearly targets of the report rows keyed by (territory, MR, division, fiscal year), in one query """
+        targets = self.env['mr.target.achievement.yearly.target'].search([
+            ('territory_id', 'in', self.territory_id.ids),
+            ('mr_id', 'in', self.mr_id.ids),
+            ('category_id', 'in', self.category_id.ids),
+            ('fiscal_year', 'in', list(set(self.mapped('fiscal_year')))),
+        ])
+        return {
+            (t.territory_id.id, t.mr_id.id, t.category_id.id, t.fiscal_year): t
+            for t in targets
+        }
 
-        for rec in self:
-            target = Target.search([
-                ('territory_id', '=', rec.territory_id.id),
-                ('mr_id', '=', rec.mr_id.id),
-                ('category_id', '=', rec.category_id.id),
-                ('fiscal_year', '=', rec.fiscal_year),
-            ], limit=1)
+    def _yearly_target_key(self):
+        return (self.territory_id.id, self.mr_id.id, self.category_id.id, self.fiscal_year)
 
+    def _compute_yearly_target(self):
+        targets = self._yearly_target_map()
+        for rec in self:
+            target = targets.get(rec._yearly_target_key())
             rec.yearly_target = target.yearly_target if target else 0.0
 
     def _inverse_yearly_target(self):
+        targets = self._yearly_target_map()
+        to_create = {}
+        audit_vals = []
         for rec in self:
-            target = self.env['mr.target.achievement.yearly.target'].search([
-                ('territory_id', '=', rec.territory_id.id),
-                ('mr_id', '=', rec.mr_id.id),
-                ('category_id', '=', rec.category_id.id),
-                ('fiscal_year', '=', rec.fiscal_year),
-            ], limit=1)
-
+            key = rec._yearly_target_key()
+            target = targets.get(key)
             old = target.yearly_target if target else 0.0
 
-            if not target:
-                target = self.env['mr.target.achievement.yearly.target'].create({
+            if target:
+                if old != rec.yearly_target:
+                    target.yearly_target = rec.yearly_target
+            else:
+                # Rows sharing a key create a single target (last value wins)
+                to_create[key] = {
                     'territory_id': rec.territory_id.id,
                     'mr_id': rec.mr_id.id,
                     'category_id': rec.category_id.id,
                     'fiscal_year': rec.fiscal_year,
                     'yearly_target': rec.yearly_target,
-                })
-            else:
-                target.yearly_target = rec.yearly_target
+                }
 
             # AUDIT LOG
             if old != rec.yearly_target:
-                self.env['mr.target.audit.log'].create({
-                    'user_id': self.env.user.id,
-                    'territory_id': rec.territory_id.id,
-                    'mr_id': rec.mr_id.id,
-                    'category_id': rec.category_id.id,
-                    'fiscal_year': rec.fiscal_year,
-                    'field_name': 'Yearly Target',
-                    'old_value': old,
-                    'new_value': rec.yearly_target,
-                })
-    
+                audit_vals.append(rec._audit_log_vals('Yearly Target', old, rec.yearly_target))
+
+        if to_create:
+            self.env['mr.target.achievement.yearly.target'].create(list(to_create.values()))
+        if audit_vals:
+            self.env['mr.target.audit.log'].create(audit_vals)
+
+    def _audit_log_vals(self, field_name, old_value, new_value):
+        return {
+            'user_id': self.env.user.id,
+            'territory_id': self.territory_id.id,
+            'mr_id': self.mr_id.id,
+            'category_id': self.category_id.id,
+            'fiscal_year': self.fiscal_year,
+            'field_name': field_name,
+            'old_value': old_value,
+            'new_value': new_value,
+        }
+
     # ================= MONTHLY TARGETS (EDITABLE) =================
-    def _get_month_target(self, month):
-        return self.env['mr.territory.target'].search([
-            ('territory_id', '=', self.territory_id.id),
-            ('fiscal_year', '=', self.fiscal_year),
-            ('month', '=', month),
-        ], limit=1)
-
-    def _set_month_target(self, month, value):
-        Target = self.env['mr.territory.target']
-        t = self._get_month_target(month)
-
-        old_value = t.target_amount if t else 0.0
-
-        if t:
-            t.target_amount = value
-        else:
-            Target.create({
-                'territory_id': self.territory_id.id,
-                'fiscal_year': self.fiscal_year,
-                'month': month,
-                'target_amount': value,
-            })
-
-        # 🔹 MONTHLY AUDIT LOG (ONLY WHEN VALUE CHANGES)
-        if old_value != value:
-            self.env['mr.target.audit.log'].create({
-                'user_id': self.env.user.id,
-                'territory_id': self.territory_id.id,
-                'mr_id': self.mr_id.id,
-                'category_id': self.category_id.id,
-                'fiscal_year': self.fiscal_year,
-                'field_name': f'Monthly Target ({month})',
-                'old_value': old_value,
-                'new_value': value,
-            })
-
-    def _make_month_fields(month):
-        def compute(self):
-            for rec in self:
-                t = rec._get_month_target(month)
-                setattr(rec, f'{month}_tgt', t.target_amount if t else 0.0)
-
-        def inverse(self):
-            for rec in self:
-                rec._set_month_target(month, getattr(rec, f'{month}_tgt'))
-
-        return compute, inverse
-    
-    MONTH_LABELS = {
-        '04': 'Apr Tgt',
-        '05': 'May Tgt',
-        '06': 'Jun Tgt',
-        '07': 'Jul Tgt',
-        '08': 'Aug Tgt',
-        '09': 'Sep Tgt',
-        '10': 'Oct Tgt',
-        '11': 'Nov Tgt',
-        '12': 'Dec Tgt',
-        '01': 'Jan Tgt',
-        '02': 'Feb Tgt',
-        '03': 'Mar Tgt',
-    }
+    # Monthly targets are set per territory, so report rows of the same territory and
+    # fiscal year share them
+    def _month_target_map(self):
+        """ Monthly targets of the report rows keyed by (territory, fiscal year, month), in one query """
+        targets = self.env['mr.territory.target'].search([
+            ('territory_id', 'in', self.territory_id.ids),
+            ('fiscal_year', 'in', list(set(self.mapped('fiscal_year')))),
+        ])
+        return {(t.territory_id.id, t.fiscal_year, t.month): t for t in targets}
+
+    def _compute_month_targets(self):
+        targets = self._month_target_map()
+        for rec in self:
+            for month in MONTH_LABELS:
+                target = targets.get((rec.territory_id.id, rec.fiscal_year, month))
+                rec[f'{month}_tgt'] = target.target_amount if target else 0.0
+
+    def _inverse_month_targets(self):
+        """ Shared inverse of the twelve month fields: only months whose value differs
+        from the stored target are written and logged """
+        targets = self._month_target_map()
+        to_create = {}
+        audit_vals = []
+        for rec in self:
+            for month in MONTH_LABELS:
+                key = (rec.territory_id.id, rec.fiscal_year, month)
+                value = rec[f'{month}_tgt']
+                target = targets.get(key)
+                if key in to_create:
+                    old_value = to_create[key]['target_amount']
+                else:
+                    old_value = target.target_amount if target else 0.0
+
+                # 🔹 MONTHLY AUDIT LOG (ONLY WHEN VALUE CHANGES)
+                if old_value == value:
+                    continue
+                audit_vals.append(rec._audit_log_vals(f'Monthly Target ({month})', old_value, value))
+
+                if target:
+                    target.target_amount = value
+                else:
+                    to_create[key] = {
+                        'territory_id': rec.territory_id.id,
+                        'fiscal_year': rec.fiscal_year,
+                        'month': month,
+                        'target_amount': value,
+                    }
+
+        if to_create:
+            self.env['mr.territory.target'].create(list(to_create.values()))
+        if audit_vals:
+            self.env['mr.target.audit.log'].create(audit_vals)
 
     for m, label in MONTH_LABELS.items():
-        c, i = _make_month_fields(m)
-        locals()[f'{m}_tgt'] = fields.Float(string=label, compute=c, inverse=i, readonly=False)
+        locals()[f'{m}_tgt'] = fields.Float(
+            string=label,
+            compute='_compute_month_targets',
+            inverse='_inverse_month_targets',
+            readonly=False,
+        )
     
     # ---------------- Q1 ----------------
     apr_ach = fields.Float(readonly=True)
@@ -481,28 +508,12 @@ class MrTargetAchievementQuarterlyReport(models.Model):
                     SELECT
                         COALESCE(NULLIF(l.amount::text, 'NaN')::numeric, 0) AS amt,
                         l.category_id,
-                        d.territory_id,
+                        l.territory_id,
                         SUBSTRING(l.month, 6, 2) AS mm,
-                        (
-                            CASE
-                                WHEN EXTRACT(MONTH FROM TO_DATE(l.month,'YYYY-MM')) >= 4
-                                THEN EXTRACT(YEAR FROM TO_DATE(l.month,'YYYY-MM'))
-                                ELSE EXTRACT(YEAR FROM TO_DATE(l.month,'YYYY-MM')) - 1
-                            END
-                        )::text || '-' ||
-                        RIGHT(
-                            (
-                                CASE
-                                    WHEN EXTRACT(MONTH FROM TO_DATE(l.month,'YYYY-MM')) >= 4
-                                    THEN EXTRACT(YEAR FROM TO_DATE(l.month,'YYYY-MM')) + 1
-                                    ELSE EXTRACT(YEAR FROM TO_DATE(l.month,'YYYY-MM'))
-                                END
-                            )::text, 2
-                        ) AS fiscal_year,
-                        d.mr_id
+                        l.fy_start::text || '-' || RIGHT((l.fy_start + 1)::text, 2) AS fiscal_year,
+                        l.mr_id
                     FROM mr_doctor_line l
-                    INNER JOIN mr_doctor d ON d.id = l.mr_doctor_id
-                    WHERE l.amount IS NOT NULL AND l.amount != 0
+                    WHERE l.mr_doctor_id IS NOT NULL AND l.amount IS NOT NULL AND l.amount != 0
                 ) fy
                 LEFT JOIN mr_territory_target t
                     ON t.territory_id = fy.territory_id
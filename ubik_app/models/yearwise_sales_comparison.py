@@ -1,10 +1,11 @@
-from odoo import models, fields, tools
+from odoo import models, fields
 import logging
 
 _logger = logging.getLogger(__name__)
 
 class MrDoctorAvgSalesReport(models.Model):
     _name = 'mr.doctor.avg.sales.report'
+    _inherit = 'ubik.sales.report.view'
     _description = 'Doctor Avg Sales Comparison (FY)'
     _auto = False
     _rec_name = 'doctor_id'
@@ -27,11 +28,9 @@ class MrDoctorAvgSalesReport(models.Model):
 
     def init(self):
         _logger.info("CREATING VIEW mr_doctor_avg_sales_report")
-        tools.drop_view_if_exists(self.env.cr, self._table)
         
         # Optimized query using CTE approach
-        self.env.cr.execute("""
-        CREATE OR REPLACE VIEW mr_doctor_avg_sales_report AS (
+        self._create_report_view("""
             WITH 
             -- Get current fiscal year and month count
             params AS (
@@ -52,21 +51,18 @@ class MrDoctorAvgSalesReport(models.Model):
             -- Base sales data with safe numeric conversion
             sales_base AS (
                 SELECT
-                    doc.territory_id,
-                    doc.doctor_id,
+                    line.id,
+                    line.territory_id,
+                    line.doctor_id,
                     rp.doc_unique_id,
                     COALESCE(NULLIF(line.amount::text, 'NaN')::numeric, 0) AS amount,
-                    
-                    CASE
-                        WHEN EXTRACT(MONTH FROM TO_DATE(line.month, 'YYYY-MM')) >= 4
-                            THEN EXTRACT(YEAR FROM TO_DATE(line.month, 'YYYY-MM'))
-                        ELSE EXTRACT(YEAR FROM TO_DATE(line.month, 'YYYY-MM')) - 1
-                    END AS fy_year
+                    line.fy_start AS fy_year
                     
                 FROM mr_doctor_line line
-                INNER JOIN mr_doctor doc ON doc.id = line.mr_doctor_id
-                INNER JOIN res_partner rp ON rp.id = doc.doctor_id
+                INNER JOIN res_partner rp ON rp.id = line.doctor_id
                 WHERE line.amount IS NOT NULL AND line.amount != 0
+                  -- Rows from FY-1 on are reported, each compared with the year before it
+                  AND line.fy_start >= (SELECT curr_fy_start - 2 FROM params)
             ),
             
             -- Aggregate sales by doctor and fiscal year
@@ -76,6 +72,7 @@ class MrDoctorAvgSalesReport(models.Model):
                     doctor_id,
                     doc_unique_id,
                     fy_year,
+                    MIN(id) AS id,
                     SUM(amount) AS total_amount
                 FROM sales_base
                 GROUP BY territory_id, doctor_id, doc_unique_id, fy_year
@@ -84,6 +81,7 @@ class MrDoctorAvgSalesReport(models.Model):
             -- Get current fiscal year data with previous year
             fy_data AS (
                 SELECT
+                    s_curr.id,
                     s_curr.territory_id,
                     s_curr.doctor_id,
                     s_curr.doc_unique_id,
@@ -101,7 +99,8 @@ class MrDoctorAvgSalesReport(models.Model):
             
             -- Final selection with calculations
             SELECT
-                ROW_NUMBER() OVER () AS id,
+                -- Stable id (lowest line id of the group) so rows keep their id across refreshes
+                fd.id,
                 fd.territory_id,
                 fd.doctor_id,
                 fd.doc_unique_id,
@@ -147,5 +146,4 @@ class MrDoctorAvgSalesReport(models.Model):
                 
             FROM fy_data fd
             CROSS JOIN params p
-        )
         """)
\ No newline at end of file
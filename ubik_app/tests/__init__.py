@@ -0,0 +1,2 @@
+from . import test_mr_doctor_lines
+from . import test_fcm_utils
@@ -0,0 +1,95 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from odoo.tests import BaseCase, tagged
+
+from odoo.addons.ubik_app import fcm_utils
+
+
+class FakeCredentials:
+    """ Service account credentials handing out token-1, token-2... """
+
+    def __init__(self):
+        self.token = None
+        self.expiry = None
+        self.refreshes = 0
+
+    def refresh(self, _request):
+        self.refreshes += 1
+        self.token = f'token-{self.refreshes}'
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+class FcmStubHandler(BaseHTTPRequestHandler):
+    """ Stand-in for the FCM send endpoint, answering 401 to revoked tokens """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        token = self.headers['Authorization'].removeprefix('Bearer ')
+        self.server.calls.append((self.client_address[1], token))
+        status = 401 if token in self.server.revoked else 200
+        body = json.dumps({'name': 'projects/test/messages/1'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@tagged('post_install', '-at_install')
+class TestFcmSend(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FcmStubHandler)
+        server.calls = []
+        server.revoked = set()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+
+        self.credentials = FakeCredentials()
+        session = fcm_utils._build_session()
+        self.addCleanup(session.close)
+        for patcher in [
+            patch.object(fcm_utils, 'FCM_SEND_URL', f'http://127.0.0.1:{server.server_port}/send'),
+            patch.object(fcm_utils, '_session', session),
+            patch.object(fcm_utils, '_credential_holder', fcm_utils._CredentialHolder('unused.json', fcm_utils.SCOPES)),
+            patch.object(fcm_utils.service_account.Credentials, 'from_service_account_file',
+                         return_value=self.credentials),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_send_reuses_token_and_connection(self):
+        for index in range(20):
+            result, error = fcm_utils.send_fcm_message(f'device-{index}', 'Title', 'Body')
+            self.assertEqual(result, fcm_utils.FCM_SENT, error)
+
+        self.assertEqual(self.credentials.refreshes, 1, "the OAuth token is fetched once")
+        self.assertEqual({token for _port, token in self.server.calls}, {'token-1'})
+        self.assertEqual(len({port for port, _token in self.server.calls}), 1,
+                         "every send goes through the same keep-alive connection")
+
+    def test_unauthorized_refreshes_token(self):
+        result, _error = fcm_utils.send_fcm_message('device', 'Title', 'Body')
+        self.assertEqual(result, fcm_utils.FCM_SENT)
+
+        self.server.revoked.add('token-1')
+        result, _error = fcm_utils.send_fcm_message('device', 'Title', 'Body')
+        self.assertEqual(result, fcm_utils.FCM_RETRY)
+
+        result, _error = fcm_utils.send_fcm_message('device', 'Title', 'Body')
+        self.assertEqual(result, fcm_utils.FCM_SENT)
+        self.assertEqual(self.credentials.refreshes, 2)
+        self.assertEqual([token for _port, token in self.server.calls], ['token-1', 'token-1', 'token-2'])
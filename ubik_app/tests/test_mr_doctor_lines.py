@@ -0,0 +1,74 @@
+from datetime import date
+
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestMrDoctorLines(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.month = date.today().strftime('%Y-%m')
+        cls.mr = cls.env['res.users'].create({'name': 'Test MR', 'login': 'test_mr_lines'})
+        cls.territory = cls.env['territory.name'].create({'name': 'Test Territory'})
+        cls.doctor = cls.env['res.partner'].create({
+            'name': 'Test Doctor',
+            'is_doctor': True,
+            'territory_id': [(6, 0, cls.territory.ids)],
+        })
+        cls.category = cls.env['product.category'].create({'name': 'Test Division'})
+        cls.product_1, cls.product_2 = cls.env['product.template'].create([
+            {'name': 'Product 1', 'categ_id': cls.category.id, 'list_price': 10.0},
+            {'name': 'Product 2', 'categ_id': cls.category.id, 'list_price': 20.0},
+        ])
+        cls.visit = cls.env['mr.doctor'].create({
+            'mr_id': cls.mr.id,
+            'doctor_id': cls.doctor.id,
+            'territory_id': cls.territory.id,
+            'line_ids': [
+                (0, 0, cls._line_vals(cls.product_1, 1.0)),
+                (0, 0, cls._line_vals(cls.product_2, 2.0)),
+            ],
+        })
+
+    @classmethod
+    def _line_vals(cls, product, qty):
+        return {
+            'category_id': cls.category.id,
+            'product_id': product.id,
+            'month': cls.month,
+            'product_qty': qty,
+            'price_unit': product.list_price,
+        }
+
+    def test_update_lines_swapped(self):
+        """ Swapping two lines in the payload must not hit the duplicate line index """
+        line_1, line_2 = self.visit.line_ids.sorted('id')
+        self.visit._update_lines([
+            self._line_vals(self.product_2, 5.0),
+            self._line_vals(self.product_1, 3.0),
+        ])
+        self.env.flush_all()
+
+        self.assertEqual(self.visit.line_ids, line_1 | line_2)
+        self.assertEqual(line_1.product_id, self.product_1)
+        self.assertEqual(line_1.product_qty, 3.0)
+        self.assertEqual(line_2.product_id, self.product_2)
+        self.assertEqual(line_2.product_qty, 5.0)
+
+    def test_update_lines_replace_and_add(self):
+        """ Unmatched values reuse the free lines, the extra ones are created """
+        product_3 = self.product_1.copy({'name': 'Product 3'})
+        line_1, line_2 = self.visit.line_ids.sorted('id')
+        created = self.visit._update_lines([
+            self._line_vals(product_3, 1.0),
+            self._line_vals(self.product_1, 4.0),
+            self._line_vals(self.product_2, 6.0),
+        ])
+        self.env.flush_all()
+
+        self.assertEqual(line_1.product_qty, 4.0)
+        self.assertEqual(line_2.product_qty, 6.0)
+        self.assertEqual(created.product_id, product_3)
+        self.assertEqual(self.visit.line_ids, line_1 | line_2 | created)
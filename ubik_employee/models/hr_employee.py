@@ -1,12 +1,129 @@
-from odoo import api, fields, models, _
+from odoo import api, fields, models, tools, _
 from odoo.exceptions import ValidationError
+from collections import namedtuple
 import logging
+import threading
+import time
 _logger = logging.getLogger(__name__)
 
+# What the API and the visit computes need to know about the employee of a user
+EmployeeProfile = namedtuple('EmployeeProfile', [
+    'employee_id', 'job_name', 'territory_ids', 'category_ids', 'manager_employee_id', 'manager_user_id',
+])
+# Employee fields the cached profiles are built from
+EMPLOYEE_CACHE_FIELDS = {'parent_id', 'user_id', 'active', 'job_id', 'territory_ids', 'product_category_ids'}
+# Employee fields the cached teams are built from
+TEAM_CACHE_FIELDS = {'parent_id', 'user_id', 'active'}
+# Seconds a cached profile or team is trusted; employee writes clear them in the
+# worker that makes them, this bounds how long the other workers may serve the
+# old values and covers changes made elsewhere (e.g. a renamed job position)
+EMPLOYEE_CACHE_TTL = 300
+
+# Worker-local caches of the profiles and teams: {name: {(dbname, user id): (value, cached at)}}.
+# They are kept apart from the registry ormcache so that editing an employee
+# does not flush the access rights, record rules and other caches of the registry.
+_employee_caches = {'profile': {}, 'team': {}}
+_employee_cache_lock = threading.Lock()
+_MISSING = object()
+
+
+def _get_cached(name, key):
+    with _employee_cache_lock:
+        entry = _employee_caches[name].get(key)
+    if entry is None or entry[1] + EMPLOYEE_CACHE_TTL < time.monotonic():
+        return _MISSING
+    return entry[0]
+
+
+def _set_cached(name, key, value):
+    with _employee_cache_lock:
+        _employee_caches[name][key] = (value, time.monotonic())
+
+
+def clear_employee_cache(dbname, *names):
+    """ Forget the cached ``names`` ('profile', 'team') of a database in this worker """
+    with _employee_cache_lock:
+        for name in names:
+            cache = _employee_caches[name]
+            for key in [key for key in cache if key[0] == dbname]:
+                del cache[key]
+
+
 class Employee(models.Model):
     _inherit = "hr.employee"
+    # Materialised path of the reporting line ("1/7/42/"), maintained by the ORM
+    # on parent_id changes, so a whole team is found with one prefix query
+    _parent_store = True
 
     doj = fields.Date(string="Joining Date", tracking=True)
+    parent_path = fields.Char(index=True)
+
+    def init(self):
+        # Prefix searches on the path (LIKE '1/7/%') whatever the collation of the database
+        tools.create_index(self.env.cr, 'hr_employee_parent_path_pattern_index', self._table,
+                           ['parent_path text_pattern_ops'])
+        # The column is new on existing databases: build the paths once
+        self.env.cr.execute("SELECT 1 FROM hr_employee WHERE parent_path IS NULL LIMIT 1")
+        if self.env.cr.fetchone():
+            self._parent_store_compute()
+
+    @api.model
+    def _get_team_members(self, user_id):
+        """ (employee id, user id) of the active employees with a user reporting
+        to the employee of ``user_id``, directly or not. Cached until an
+        employee's manager, user or active flag changes, EMPLOYEE_CACHE_TTL at most. """
+        key = (self.env.cr.dbname, user_id)
+        members = _get_cached('team', key)
+        if members is _MISSING:
+            members = self._read_team_members(user_id)
+            _set_cached('team', key, members)
+        return members
+
+    @api.model
+    def _read_team_members(self, user_id):
+        self.flush_model(['parent_path', 'user_id', 'active'])
+        self.env.cr.execute("""
+            SELECT member.id, member.user_id
+              FROM hr_employee manager
+              JOIN hr_employee member
+                ON member.parent_path LIKE manager.parent_path || '%%'
+               AND member.id != manager.id
+             WHERE manager.user_id = %s
+               AND member.user_id IS NOT NULL
+               AND member.active
+             ORDER BY member.parent_path
+        """, [user_id])
+        return tuple(self.env.cr.fetchall())
+
+    @api.model
+    def _get_employee_profile(self, user_id):
+        """ EmployeeProfile of the employee linked to ``user_id``, None without one """
+        key = (self.env.cr.dbname, user_id)
+        profile = _get_cached('profile', key)
+        if profile is _MISSING:
+            profile = self._read_employee_profile(user_id)
+            _set_cached('profile', key, profile)
+        return profile
+
+    @api.model
+    def _read_employee_profile(self, user_id):
+        employee = self.sudo().search([('user_id', '=', user_id)], limit=1)
+        if not employee:
+            return None
+        return EmployeeProfile(
+            employee_id=employee.id,
+            # The role checks compare the untranslated job names
+            job_name=employee.job_id.with_context(lang='en_US').name or None,
+            territory_ids=tuple(employee.territory_ids.ids),
+            category_ids=tuple(employee.product_category_ids.ids),
+            manager_employee_id=employee.parent_id.id or None,
+            manager_user_id=employee.parent_id.user_id.id or None,
+        )
+
+    @api.model
+    def _get_team_user_ids(self, user_id):
+        """ Users reporting to ``user_id`` at any depth """
+        return [member_user_id for _employee_id, member_user_id in self._get_team_members(user_id)]
    
     ############## UBIK APP CODE:starts ###################
     ####### Old code for single territory assigned to MR in Employee module: starts ##############
@@ -130,15 +247,43 @@ class Employee(models.Model):
                     partner.name
                 )
 
+    def _update_parent_path(self):
+        """ Rebuild the reporting path of the employees whose manager was recomputed:
+        the ORM only maintains parent_path when parent_id itself is written """
+        self.flush_model(['parent_id'])
+        for employees in self.grouped('parent_id').values():
+            employees._parent_store_update()
+
     @api.model_create_multi
     def create(self, vals_list):
         employees = super().create(vals_list)
         employees._sync_contact_details()
+        # The cached profiles (a user may get an employee) and teams
+        if any(vals.get('user_id') for vals in vals_list):
+            clear_employee_cache(self.env.cr.dbname, 'profile', 'team')
         return employees
 
     def write(self, vals):
+        # parent_id is computed from the department: a new department may give
+        # the employees another manager without parent_id being written
+        old_parents = None
+        if 'department_id' in vals and 'parent_id' not in vals:
+            old_parents = {employee.id: employee.parent_id for employee in self}
+
         res = super().write(vals)
 
+        moved = self.browse()
+        if old_parents is not None:
+            moved = self.filtered(lambda employee: employee.parent_id != old_parents[employee.id])
+            if moved:
+                moved._update_parent_path()
+
+        # The cached profiles and teams
+        if EMPLOYEE_CACHE_FIELDS & vals.keys() or moved:
+            clear_employee_cache(self.env.cr.dbname, 'profile')
+        if TEAM_CACHE_FIELDS & vals.keys() or moved:
+            clear_employee_cache(self.env.cr.dbname, 'team')
+
         # Check which fields were updated
         territory_changed = 'territory_ids' in vals
         pan_changed = 'ssnid' in vals
@@ -150,6 +295,8 @@ class Employee(models.Model):
             self._sync_contact_details()
 
         return res
-   
-  
-  
\ No newline at end of file
+
+    def unlink(self):
+        res = super().unlink()
+        clear_employee_cache(self.env.cr.dbname, 'profile', 'team')
+        return res